@@ -0,0 +1,69 @@
+'''
+Times creation of every bound AssembledADT sub type of an ISA and repeated
+field type lookups on them.  Each repetition binds to a fresh BitVector
+modifier, like binding the ISA into a new family, so no bound type is
+reused across repetitions (Assemblers are, as they would be).
+
+    python -m benchmarks.bench_aadt_types [repeat]
+'''
+import itertools as it
+import sys
+import time
+
+from hwtypes import BitVector, make_modifier
+from hwtypes.adt import Product, Sum, Tuple
+
+from peak.assembler import AssembledADT, Assembler
+
+from examples.arm.isa import Inst as arm_isa
+from examples.pe1.isa import Inst as pe1_isa
+
+ISAS = {
+    'arm': arm_isa,
+    'pe1': pe1_isa,
+}
+
+_fresh = it.count()
+
+def walk(aadt_t, seen):
+    if not isinstance(aadt_t, type) or not issubclass(aadt_t, AssembledADT):
+        return
+    seen.add(aadt_t)
+    adt_t = aadt_t.adt_t
+    if issubclass(adt_t, Sum):
+        for T in adt_t.fields:
+            walk(aadt_t[T], seen)
+    elif issubclass(adt_t, Product):
+        for name in adt_t.field_dict:
+            walk(getattr(aadt_t, name), seen)
+    elif issubclass(adt_t, Tuple):
+        for idx in adt_t.field_dict:
+            walk(aadt_t[idx], seen)
+
+
+def bench(isa, repeat, lookups=100):
+    create = lookup = 0
+    for _ in range(repeat):
+        bv_type = make_modifier(f'Bench{next(_fresh)}')(BitVector)
+        seen = set()
+        start = time.perf_counter()
+        walk(AssembledADT[isa, Assembler, bv_type], seen)
+        create += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            walk(AssembledADT[isa, Assembler, bv_type], set())
+        lookup += (time.perf_counter() - start) / lookups
+    return len(seen), create / repeat, lookup / repeat
+
+
+def main(repeat=20):
+    for name, isa in ISAS.items():
+        # build the Assembler and the unbound caches outside of the timing
+        bench(isa, 1)
+        n, create, lookup = bench(isa, repeat)
+        print(f'{name}: {n} types, create {create*1e3:.2f} ms, walk {lookup*1e3:.3f} ms')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
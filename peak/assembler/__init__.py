@@ -1,3 +1,5 @@
 from .assembler import *
 from .assembled_adt import AssembledADT, AssembledADTRecursor, _TAG
 from .assembled_adt import MagmaADT
+from .assembled_adt_array import AssembledADTArray
+from .instruction_stream import InstructionStream
@@ -1,33 +1,39 @@
 import abc
 from collections import Counter
-from functools import reduce
-import itertools as it
+from types import FunctionType
 import typing as tp
+import weakref
 
 from hwtypes import AbstractBitVectorMeta, TypeFamily, Enum, Sum, Product, Tuple
-from hwtypes import AbstractBitVector, AbstractBit
-from hwtypes.adt_meta import BoundMeta
+from hwtypes import AbstractBitVector, AbstractBit, BitVector, SMTBitVector
+from hwtypes.adt_meta import BoundMeta, ReservedNameError
 from hwtypes.modifiers import is_modified
 
 import magma as m
 
 from .assembler_abc import AssemblerMeta
+from .assembled_adt_array import AssembledADTArray
 from .assembler_util import _issubclass
+from .cache import LRUCache
 
 class _MISSING: pass
 class _TAG: pass
 
+# Attributes of bound types which would shadow a field of the same name
 RESERVED_NAMES = frozenset({
     'adt_t',
     'assembler_t',
     'bv_type',
-    'default_bv'
+    'default_bv',
+    'enable_decode_cache',
+    'disable_decode_cache',
+    'decode_cache_info',
+    'enable_interning',
+    'disable_interning',
+    'from_fields_many',
 })
 
-#Given a layout specification and field values, construct a bitvector using concatenation
-def _create_from_layout(width, layout, field_bvs, bv_type: AbstractBitVector, default_value: int):
-    if layout.keys() != field_bvs.keys():
-        raise ValueError('layout does not match field_bvs')
+def _check_layout(width, layout):
     ranges = sorted(layout.values())
     if not all(
             type(r0) == type(r1) == tuple
@@ -37,14 +43,80 @@ def _create_from_layout(width, layout, field_bvs, bv_type: AbstractBitVector, de
             for r0, r1 in zip(ranges, ranges[1:])):
         raise ValueError('invalid layout')
 
-    slots = [bv_type[1](default_value) for i in range(width)]
-    for field_name, (low, hi) in layout.items():
-        # need to add None to keep the indexing consistent
-        slots[low:hi] = field_bvs[field_name], *(None for _ in range(low+1, hi))
-    bv = reduce(bv_type.concat, (s for s in slots if s is not None))
-    assert bv.size == width
+
+#Given a layout specification, compile a function which constructs a
+#bitvector from field values
+def _compile_layout(width, layout, bv_type: AbstractBitVector):
+    '''
+    Returns build(field_bvs, default_value) where padding bits are filled
+    with default_value.
+
+    Concrete BitVectors are packed with shift/or on ints.  Other bv types
+    (SMT, magma) get one concat per field and per run of padding bits.
+    '''
+    _check_layout(width, layout)
+    pieces = []
+    pos = 0
+    for name, (lo, hi) in sorted(layout.items(), key=lambda kv: kv[1]):
+        if pos < lo:
+            pieces.append((None, pos, lo))
+        pieces.append((name, lo, hi))
+        pos = hi
+    if pos < width:
+        pieces.append((None, pos, width))
+
+    def pad(lo, hi):
+        return f'({hex((1 << hi) - (1 << lo))} if default_value & 1 else 0)'
+
+    if _issubclass(bv_type, BitVector):
+        terms = []
+        for name, lo, hi in pieces:
+            if name is None:
+                terms.append(pad(lo, hi))
+            else:
+                term = f'int(field_bvs[{name!r}])'
+                terms.append(f'{term} << {lo}' if lo else term)
+        expr = ' | '.join(terms) if terms else '0'
+    else:
+        expr = None
+        for name, lo, hi in pieces:
+            if name is None:
+                term = f'bv_type[{hi - lo}]({pad(0, hi - lo)})'
+            else:
+                term = f'field_bvs[{name!r}]'
+            expr = term if expr is None else f'bv_type.concat({expr}, {term})'
+        if expr is None:
+            expr = '0'
     #Need to cast to bv_type since magma's concats do not return bv_type
-    return bv_type[width](bv)
+    src = f'''
+def build(field_bvs, default_value):
+    return bv_type[{width}]({expr})
+'''
+    env = dict(bv_type=bv_type)
+    exec(src, env)
+    return env['build']
+
+
+def _layout_builder(cls, T=None):
+    '''
+    Compiled builder for cls (or for alternative T of a Sum), memoized on
+    the class.
+    '''
+    builders = cls._builders_
+    try:
+        return builders[T]
+    except KeyError:
+        pass
+    assembler = cls.assembler_t(cls.adt_t)
+    if T is None:
+        layout = assembler.layout
+    else:
+        layout = {
+            'value': assembler.layout[T],
+            'tag': assembler.tag_layout,
+        }
+    builder = builders[T] = _compile_layout(assembler.width, layout, cls.bv_type)
+    return builder
 
 
 def _as_bv(v):
@@ -64,22 +136,25 @@ def _tuple_builder(cls, *args, default_bv):
     adt_t = cls.adt_t
     assert len(args) == len(adt_t.fields)
 
-    assembler = cls.assembler_t(adt_t)
-    fields = {i: _as_bv(cls[i](v)) for i, v in enumerate(args)}
-    bv_value = _create_from_layout(
-            assembler.width, assembler.layout, fields, cls.bv_type, default_bv)
-    return cls(bv_value)
+    values = {i: cls[i](v) for i, v in enumerate(args)}
+    if cls._lazy_:
+        return _lazy_value(cls, values, default_bv)
+    fields = {i: _as_bv(v) for i, v in values.items()}
+    return cls(_layout_builder(cls)(fields, default_bv))
 
 
 def _product_builder(cls, *, default_bv, **kwargs):
     adt_t = cls.adt_t
     assert kwargs.keys() == adt_t.field_dict.keys()
-    assembler = cls.assembler_t(adt_t)
+    values = {k: getattr(cls, k)(v) for k, v in kwargs.items()}
+    if cls._lazy_:
+        return _lazy_value(cls, values, default_bv)
+    fields = {k: _as_bv(v) for k, v in values.items()}
+    return cls(_layout_builder(cls)(fields, default_bv))
 
-    fields = {k: _as_bv(getattr(cls, k)(v)) for k, v in kwargs.items()}
-    bv_value = _create_from_layout(
-            assembler.width, assembler.layout, fields, cls.bv_type, default_bv)
-    return cls(bv_value)
+
+def _enum_builder(cls, value, default_bv):
+    return cls(value)
 
 
 def _sum_builder(cls, T, value, *, tag_bv, default_bv):
@@ -91,86 +166,234 @@ def _sum_builder(cls, T, value, *, tag_bv, default_bv):
     else:
         tag_bv = assembler.assemble_tag(T, cls.bv_type)
 
+    value = cls[T](value)
+    if cls._lazy_:
+        return _lazy_value(cls, (T, value, tag_bv), default_bv)
     fields = {
-        'value': _as_bv(cls[T](value)),
+        'value': _as_bv(value),
         'tag': tag_bv,
     }
-    layout = {
-        'value': assembler.layout[T],
-        'tag': assembler.tag_layout,
-    }
-
-    bv_value = _create_from_layout(
-            assembler.width, layout, fields, cls.bv_type, default_bv)
-    return cls(bv_value)
+    return cls(_layout_builder(cls, T)(fields, default_bv))
+
+
+# (builder, params, builder_args) -> generated from_fields, shared by every
+# bound type with the same parameter names, e.g. all Enums or all Sums
+_from_fields_protos = {}
+
+def _from_fields(builder, params, builder_args, annotations):
+    '''
+    Returns the from_fields classmethod with parameters params, a list of
+    (name, default source) where ('*', None) starts the keyword only
+    parameters.  The code is compiled once per signature and each bound
+    type gets a copy carrying its own annotations.
+    '''
+    key = builder, tuple(params), builder_args
+    proto = _from_fields_protos.get(key)
+    if proto is None:
+        sig = ', '.join(k if d is None else f'{k}={d}' for k, d in params)
+        src = f'''
+def from_fields(cls, {sig}):
+    return builder(cls, {builder_args}, default_bv=default_bv)
+'''
+        env = dict(builder=builder)
+        exec(src, env, env)
+        proto = _from_fields_protos[key] = env['from_fields']
+    fn = FunctionType(proto.__code__, proto.__globals__, proto.__name__, proto.__defaults__)
+    if proto.__kwdefaults__ is not None:
+        fn.__kwdefaults__ = dict(proto.__kwdefaults__)
+    fn.__annotations__ = annotations
+    return classmethod(fn)
+
+
+def _lazy_value(cls, parts, default_bv):
+    '''
+    Builds a value which keeps its field expressions in _parts_ (a dict of
+    fields or (T, value, tag_bv) for a Sum).  _value_ is only packed on
+    first use so reading a field back returns the original expression
+    instead of a slice of a concat.
+    '''
+    obj = cls.__new__(cls)
+    obj._parts_ = parts
+    obj._default_bv_ = default_bv
+    return obj
+
+
+def _pack(aadt):
+    cls = type(aadt)
+    parts = aadt._parts_
+    if _issubclass(cls.adt_t, Sum):
+        T, value, tag_bv = parts
+        fields = {'value': _as_bv(value), 'tag': tag_bv}
+        builder = _layout_builder(cls, T)
+    else:
+        fields = {k: _as_bv(v) for k, v in parts.items()}
+        builder = _layout_builder(cls)
+    return builder(fields, aadt._default_bv_)
+
+
+def _field_slices(cls):
+    '''
+    Maps each field key of cls to (idx, sub_t, tag_bv) so field access does
+    not go through Sub.  idx is an int for Bit fields (sub_t is then None)
+    and a slice otherwise.  tag_bv is the tag constant for Sum fields.
+    '''
+    assembler = cls.assembler_t(cls.adt_t)
+    is_sum = _issubclass(cls.adt_t, Sum)
+    table = {}
+    for key in cls.adt_t.field_dict:
+        sub = assembler.sub[key]
+        sub_t = cls[key]
+        if issubclass(sub_t, AbstractBit):
+            idx, sub_t = sub.idx.start, None
+        else:
+            idx = sub.idx
+        if is_sum:
+            tag_bv = assembler.assemble_tag(key, cls.bv_type)
+        else:
+            tag_bv = None
+        table[key] = idx, sub_t, tag_bv
+    if is_sum:
+        cls._tag_idx_ = assembler.sub.tag_idx
+    cls._field_slices_ = table
+    return table
 
 
 class AssembledADTMeta(BoundMeta):
     def __init__(cls, name, bases, namespace, **kwargs):
         if not cls.is_bound:
             return
-        assembler = cls.assembler_t(cls.adt_t)
-        default_bv_arg = (
-            f'default_bv',
-            f'tp.Optional[int] = 0',
-        )
+        for k in cls.adt_t.field_dict:
+            if isinstance(k, str) and k in RESERVED_NAMES:
+                raise ReservedNameError(f'Field name {k} is reserved by AssembledADT')
+        cls._decode_cache_ = None
+        cls._interned_ = None
+        cls._builders_ = {}
+        cls._field_slices_ = None
+        # key/attr -> sub type, see _sub_t
+        cls._sub_types_ = {}
+        cls._opcodes_ = None
+        # Keep field expressions of values built from fields, see _lazy_value
+        cls._lazy_ = _issubclass(cls.bv_type, SMTBitVector)
+        cls._assembler_ = assembler = cls.assembler_t(cls.adt_t)
         if is_modified(cls.adt_t):
             raise TypeError(f"Cannot create Assembled ADT from a modified adt type {cls.adt_t}")
+        default_bv = ('default_bv', '0')
+        annotations = {}
         if issubclass(cls.adt_t, Product):
-            arg_strs = [(f'{k}', f'{v.__name__!r}')
-                    for k, v in cls.adt_t.field_dict.items()]
-            sig_args = it.chain(arg_strs, [('*',), default_bv_arg])
-            sig = ', '.join(map(': '.join, sig_args))
-            builder_args = ', '.join(it.starmap('{0}={0}'.format, arg_strs))
+            names = list(cls.adt_t.field_dict)
+            params = [(k, None) for k in names] + [('*', None), default_bv]
+            builder_args = ', '.join(f'{k}={k}' for k in names)
             builder = _product_builder
+            for k, v in cls.adt_t.field_dict.items():
+                annotations[k] = v.__name__
         elif issubclass(cls.adt_t, Tuple):
-            arg_strs = [(f'_{k}', f'{v.__name__!r}')
-                    for k, v in cls.adt_t.field_dict.items()]
-            sig_args = it.chain(arg_strs, [('*',), default_bv_arg])
-            sig = ', '.join(map(': '.join, sig_args))
-            builder_args = ', '.join(k[0] for k in arg_strs)
+            names = [f'_{k}' for k in cls.adt_t.field_dict]
+            params = [(k, None) for k in names] + [('*', None), default_bv]
+            builder_args = ', '.join(names)
             builder = _tuple_builder
+            for k, v in zip(names, cls.adt_t.field_dict.values()):
+                annotations[k] = v.__name__
         elif issubclass(cls.adt_t, Enum):
-            sig = f"value, {default_bv_arg[0]}: {default_bv_arg[1]}"
-            builder_args = "value"
-            def builder(cls, v, default_bv):
-                return cls(v)
+            # member -> opcode constant so comparing against a member is a
+            # lookup and a single compare, see AssembledADT.__eq__
+            cls._opcodes_ = {
+                inst: assembler.assemble(inst, cls.bv_type)
+                for inst in cls.adt_t.enumerate()
+            }
+            params = [('value', None), default_bv]
+            builder_args = 'value'
+            builder = _enum_builder
         elif issubclass(cls.adt_t, Sum):
-            value_types = ', '.join(
-                map(
-                    lambda t: repr(t.__name__),
-                    (cls.bv_type, *cls.adt_t.fields)
-                )
-            )
-            tag_type = f'{cls.bv_type.__name__!r}[{assembler.tag_width}]'
-            sig = (
-                f'T: type, '
-                f'value: tp.Union[{value_types}], '
-                f'*, '
-                f'tag_bv: tp.Optional[{tag_type}] = None, '
-                f'{default_bv_arg[0]}: {default_bv_arg[1]}'
-            )
-            builder_args = ('T=T, value=value, tag_bv=tag_bv')
+            params = [('T', None), ('value', None), ('*', None), ('tag_bv', 'None'), default_bv]
+            builder_args = 'T=T, value=value, tag_bv=tag_bv'
             builder = _sum_builder
+            value_types = (cls.bv_type, *cls.adt_t.fields)
+            annotations['T'] = type
+            annotations['value'] = tp.Union[tuple(t.__name__ for t in value_types)]
+            annotations['tag_bv'] = tp.Optional[f'{cls.bv_type.__name__}[{assembler.tag_width}]']
         else:
             return
+        annotations['default_bv'] = tp.Optional[int]
+        annotations['return'] = cls.__name__
+        cls.from_fields = _from_fields(builder, params, builder_args, annotations)
+
+    def __call__(cls, *args, **kwargs):
+        cache = cls.__dict__.get('_decode_cache_')
+        interned = cls.__dict__.get('_interned_')
+        if (cache is None and interned is None) or kwargs or len(args) != 1:
+            return super().__call__(*args, **kwargs)
+        word = args[0]
+        if not isinstance(word, (int, BitVector)):
+            return cls._intern(super().__call__(word))
+        if cache is None:
+            return cls._from_word(word)
+        key = type(word), int(word)
+        obj = cache.get(key, _MISSING)
+        if obj is _MISSING:
+            obj = cache[key] = cls._from_word(word)
+        return obj
+
+    def _from_word(cls, word):
+        interned = cls.__dict__.get('_interned_')
+        if interned is not None and isinstance(word, (int, cls._word_t_)):
+            # ints which do not fit are never keys so need no check here
+            obj = interned.get(int(word))
+            if obj is not None:
+                return obj
+        return cls._intern(super().__call__(word))
+
+    def _intern(cls, obj):
+        interned = cls.__dict__.get('_interned_')
+        if interned is None:
+            return obj
+        return interned.setdefault(int(obj._value_), obj)
+
+    def enable_interning(cls):
+        '''
+        Constructing a value with the same bits as a live value returns
+        that value, so equal values share one instance.  Only for concrete
+        bv types whose values are immutable.  Values are held weakly.
+        '''
+        if not cls.is_bound:
+            raise TypeError('Cannot enable interning on unbound type')
+        if not _issubclass(cls.bv_type, BitVector):
+            raise TypeError(f'Cannot intern values of {cls.bv_type}')
+        cls._word_t_ = cls.bv_type[cls.assembler_t(cls.adt_t).width]
+        cls._interned_ = weakref.WeakValueDictionary()
+
+    def disable_interning(cls):
+        cls._interned_ = None
+
+    def enable_decode_cache(cls, maxsize: tp.Optional[int] = 1024):
+        '''
+        Reuse the value constructed from a raw concrete word.
+        Safe because assembled adt values are immutable.
+        '''
+        if not cls.is_bound:
+            raise TypeError('Cannot enable decode cache on unbound type')
+        cls._decode_cache_ = LRUCache(maxsize)
 
-        from_fields = f'''
-@classmethod
-def from_fields(cls, {sig}) -> {cls.__name__!r}:
-    return builder(cls, {builder_args}, default_bv=default_bv)
-'''
-        env = dict(builder=builder, tp=tp)
-        exec(from_fields, env, env)
-        cls.from_fields = env['from_fields']
+    def disable_decode_cache(cls):
+        cls._decode_cache_ = None
+
+    def decode_cache_info(cls):
+        cache = cls.__dict__.get('_decode_cache_')
+        if cache is None:
+            return None
+        return cache.info()
+
+    def _namespace_from_idx(cls, idx):
+        # Bound types add no instance attributes, keep values free of __dict__
+        namespace = super()._namespace_from_idx(idx)
+        namespace['__slots__'] = ()
+        return namespace
 
     def _name_from_idx(cls, idx):
         return f'{cls.__name__}[{", ".join(map(repr, idx))}]'
 
     def __getitem__(cls, key: tp.Tuple[BoundMeta, AssemblerMeta, AbstractBitVectorMeta]):
         if cls.is_bound:
-            val = cls.adt_t[key]
-            return cls.unbound_t[(val, *cls.fields[1:])]
+            return cls._sub_t(key, cls._adt_item)
         else:
             adt_t = key[0]
             if (_issubclass(adt_t, AbstractBitVector)
@@ -182,11 +405,34 @@ def from_fields(cls, {sig}) -> {cls.__name__!r}:
             return T
 
     def __getattr__(cls, attr):
+        return cls._sub_t(attr, cls._adt_attr)
+
+    def _adt_item(cls, key):
+        return cls.adt_t[key]
+
+    def _adt_attr(cls, attr):
         val = getattr(cls.adt_t, attr, _MISSING)
-        if val is not _MISSING:
-            return cls.unbound_t[(val, *cls.fields[1:])]
-        else:
+        if val is _MISSING:
             raise AttributeError(attr)
+        return val
+
+    def _sub_t(cls, key, lookup):
+        '''
+        Bound type of field key of adt_t, memoized so repeated field access
+        on the type skips indexing unbound_t.
+        '''
+        sub_types = cls.__dict__.get('_sub_types_')
+        try:
+            return sub_types[key]
+        except (KeyError, TypeError):
+            pass
+        T = cls.unbound_t[(lookup(key), *cls.fields[1:])]
+        if sub_types is not None:
+            try:
+                sub_types[key] = T
+            except TypeError:
+                pass
+        return T
 
     def __contains__(cls, T):
         return T in cls.adt_t
@@ -224,51 +470,77 @@ def from_fields(cls, {sig}) -> {cls.__name__!r}:
 
 
 class AssembledADT(metaclass=AssembledADTMeta):
+    # _assembler_ is a class attribute of bound types
+    __slots__ = ('_value_', '_parts_', '_default_bv_', '__weakref__')
+
     def __init__(self, adt):
         cls = type(self)
-        self._assembler_ = assembler = cls.assembler_t(cls.adt_t)
-        if isinstance(adt, cls):
+        assembler = cls._assembler_
+        self._parts_ = None
+        if isinstance(adt, cls) and adt._parts_ is not None:
+            self._parts_ = adt._parts_
+            self._default_bv_ = adt._default_bv_
+        elif isinstance(adt, cls):
             self._value_ =  adt._value_
         elif isinstance(adt, cls.adt_t):
             self._value_ = assembler.assemble(adt, cls.bv_type)
+        elif isinstance(adt, int):
+            if adt < 0 or adt.bit_length() > assembler.width:
+                raise ValueError(f'{adt} does not fit in {assembler.width} bits')
+            self._value_ = cls.bv_type[assembler.width](adt)
         elif not isinstance(adt, cls.bv_type[assembler.width]):
             raise TypeError(f'expected {cls.bv_type[assembler.width]} or {cls.adt_t} not {adt}:{type(adt)}')
         else:
             self._value_ = adt
 
+    @classmethod
+    def from_fields_many(cls, *args, **kwargs) -> AssembledADTArray:
+        '''
+        Batched from_fields, takes the same arguments with a column (a
+        sequence or an array) in place of each field value and packs the
+        whole batch at once, see AssembledADTArray.from_fields.
+        '''
+        return AssembledADTArray[cls.adt_t, cls.assembler_t].from_fields(*args, **kwargs)
+
     def __getitem__(self, key):
         cls = type(self)
-        sub = self._assembler_.sub.get(key, _MISSING)
-        if sub is not _MISSING:
-            if issubclass(cls[key], AbstractBit):
-                field = self._value_[sub.idx][0]
-            else:
-                field = cls[key](self._value_[sub.idx])
-        elif key is _TAG and not _issubclass(cls.adt_t, Sum):
-            raise KeyError(f"can only get tag from Sum types")
-        elif not key is _TAG:
-            raise KeyError(key)
-
-        if not _issubclass(cls.adt_t, Sum):
+        table = cls._field_slices_
+        if table is None:
+            table = _field_slices(cls)
+        parts = self._parts_
+        try:
+            idx, sub_t, tag_bv = table[key]
+        except KeyError:
+            if key is not _TAG:
+                raise KeyError(key) from None
+            elif not _issubclass(cls.adt_t, Sum):
+                raise KeyError(f"can only get tag from Sum types") from None
+            elif parts is not None:
+                return parts[2]
+            return self._value_[cls._tag_idx_]
+
+        if parts is not None and tag_bv is None:
+            return parts[key]
+        elif parts is not None and parts[0] is key:
+            field = parts[1]
+        elif sub_t is None:
+            # Bits are not wrapped and idx is an int
+            field = self._value_[idx]
+        else:
+            field = sub_t(self._value_[idx])
+        if tag_bv is None:
             return field
-        tag = self._value_[self._assembler_.sub.tag_idx]
-        # if key is an assembled adt class just grab the type from it
-        if key is _TAG:
-            return tag
-
-        if _issubclass(key, AssembledADT):
-            T = key.adt_t
+        if parts is not None:
+            match = parts[2] == tag_bv
         else:
-            T = key
-
-        if T in cls.adt_t:
-            T = self._assembler_.assemble_tag(T, cls.bv_type)
-        if not isinstance(T, cls.bv_type[self._assembler_.tag_width]):
-            raise TypeError(type(T), T, cls.adt_t)
-        match = tag == T
+            match = self._value_[cls._tag_idx_] == tag_bv
         return cls.adt_t.Match(match, field, safe=False)
 
     def __getattr__(self, attr):
+        if attr == '_value_' and self._parts_ is not None:
+            # lazily packed, see _lazy_value
+            value = self._value_ = _pack(self)
+            return value
         try:
             return self[attr]
         except KeyError:
@@ -276,6 +548,9 @@ class AssembledADT(metaclass=AssembledADTMeta):
         raise AttributeError(attr)
 
     def __hash__(self):
+        # No identity shortcut for interned values: a value built before
+        # enable_interning (or after disable_interning) is equal to the
+        # interned one and must hash the same.
         return hash(self._value_)
 
     def __repr__(self):
@@ -283,6 +558,12 @@ class AssembledADT(metaclass=AssembledADTMeta):
 
     def __eq__(self, other):
         cls = type(self)
+        if other is self and cls._interned_ is not None:
+            # always the case for equal interned values
+            return cls.bv_type.get_family().Bit(1)
+        opcodes = cls._opcodes_
+        if opcodes is not None and isinstance(other, cls.adt_t):
+            return self._value_ == opcodes[other]
         #The bug is here. cls.adt_t (opcode) is different than opcode
         if isinstance(other, cls):
             return self._value_ == other._value_
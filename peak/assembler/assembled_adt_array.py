@@ -0,0 +1,223 @@
+import typing as tp
+
+import numpy as np
+
+from hwtypes import AbstractBitVector, AbstractBit
+from hwtypes.adt import Product, Sum, Tuple
+from hwtypes.adt_meta import BoundMeta
+
+from .assembler import Assembler, _extract, _fits, _words_dtype
+from .assembler_util import _issubclass
+
+class AssembledADTArrayMeta(BoundMeta):
+    def _get_idx(cls, idx):
+        # AssembledADTArray[T] uses the default Assembler
+        if not isinstance(idx, tuple):
+            idx = idx, Assembler
+        return super()._get_idx(idx)
+
+    def _name_from_idx(cls, idx):
+        return f'{cls.__name__}[{", ".join(map(repr, idx))}]'
+
+    @property
+    def adt_t(cls):
+        return cls.fields[0]
+
+    @property
+    def assembler_t(cls):
+        return cls.fields[1]
+
+    @property
+    def assembler(cls) -> Assembler:
+        return cls.assembler_t(cls.adt_t)
+
+    def sub_t(cls, key) -> tp.Optional['AssembledADTArrayMeta']:
+        '''
+        Array type of field key or None if the field is a Bit/BitVector (whose
+        columns are plain arrays of ints).
+        '''
+        field = cls.adt_t.field_dict[key]
+        if _issubclass(field, (AbstractBit, AbstractBitVector)):
+            return None
+        return cls.unbound_t[field, cls.assembler_t]
+
+
+class AssembledADTArray(metaclass=AssembledADTArrayMeta):
+    '''
+    Column of instructions stored as one array of packed opcodes (uint64, or
+    python ints when wider than 64 bits).  Fields are read and built
+    column-wise using the layout of the assembler so no per instruction
+    objects are created.
+    '''
+    def __init__(self, words):
+        cls = type(self)
+        width = cls.assembler.width
+        words = np.asarray(words, dtype=_words_dtype(width))
+        if words.ndim != 1:
+            raise ValueError('expected a 1-d array of opcodes')
+        _check_fits(words, width, 'opcode')
+        self._words = words
+
+    @classmethod
+    def from_insts(cls, insts: tp.Iterable['adt_t']) -> 'AssembledADTArray':
+        return cls(cls.assembler.assemble_many(insts))
+
+    @classmethod
+    def from_fields(cls, *args, default_bv: int = 0, **kwargs) -> 'AssembledADTArray':
+        '''
+        Product: from_fields(name=column, ...)
+        Tuple:   from_fields(column, ...)
+        Sum:     from_fields(T, column)
+
+        A column is an AssembledADTArray of the field type, an array of ints
+        for Bit/BitVector fields or a sequence of field values.  Like
+        AssembledADT.from_fields bits not covered by a field are filled
+        with default_bv.
+        '''
+        adt_t = cls.adt_t
+        assembler = cls.assembler
+        dtype = _words_dtype(assembler.width)
+        if _issubclass(adt_t, Sum):
+            T, column = args
+            if kwargs or T not in adt_t.fields:
+                raise TypeError(f'expected from_fields(T, column) for {adt_t}')
+            lo, _ = assembler.layout[T]
+            words = _column_words(cls, T, column, dtype)
+            t = words.dtype.type
+            words = t(assembler._tag_asm(T)) | words << t(lo)
+            if default_bv & 1:
+                words |= t(_padding(assembler, (assembler.layout[T], assembler.tag_layout)))
+            return cls(words)
+        elif _issubclass(adt_t, Product):
+            if args or kwargs.keys() != adt_t.field_dict.keys():
+                raise TypeError(f'expected a column for each of {list(adt_t.field_dict)}')
+            columns = kwargs
+        elif _issubclass(adt_t, Tuple):
+            if kwargs or len(args) != len(adt_t.fields):
+                raise TypeError(f'expected {len(adt_t.fields)} columns')
+            columns = dict(enumerate(args))
+        else:
+            raise TypeError(f'from_fields is not supported for {adt_t}')
+
+        words = None
+        for key, column in columns.items():
+            sub_words = _column_words(cls, key, column, dtype)
+            if words is not None and len(sub_words) != len(words):
+                raise ValueError('columns have different lengths')
+            t = sub_words.dtype.type
+            shifted = sub_words << t(assembler.layout[key][0])
+            words = shifted if words is None else words | shifted
+        if words is None:
+            raise TypeError(f'{adt_t} has no fields')
+        if default_bv & 1:
+            words |= words.dtype.type(_padding(assembler, assembler.layout.values()))
+        return cls(words)
+
+    @property
+    def words(self) -> np.ndarray:
+        return self._words
+
+    @property
+    def nbytes(self) -> int:
+        return self._words.nbytes
+
+    def to_insts(self) -> tp.List['adt_t']:
+        return type(self).assembler.disassemble_many(self._words)
+
+    def field(self, key) -> tp.Union['AssembledADTArray', np.ndarray]:
+        '''
+        Column of field key.  For a Sum key is an alternative and rows which
+        hold a different alternative contain garbage, see match.
+        '''
+        cls = type(self)
+        try:
+            lo, hi = cls.assembler.layout[key]
+        except (KeyError, TypeError):
+            raise KeyError(key) from None
+        sub_words = _extract(self._words, lo, hi)
+        sub_t = cls.sub_t(key)
+        if sub_t is None:
+            return sub_words
+        return sub_t(sub_words)
+
+    @property
+    def tag(self) -> np.ndarray:
+        cls = type(self)
+        if not _issubclass(cls.adt_t, Sum):
+            raise TypeError('tag only for Sum')
+        return _extract(self._words, *cls.assembler.tag_layout)
+
+    def match(self, T) -> np.ndarray:
+        '''
+        Boolean mask of the rows which hold alternative T of a Sum.
+        '''
+        tags = self.tag
+        return tags == tags.dtype.type(type(self).assembler._tag_asm(T))
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        try:
+            return self.field(attr)
+        except KeyError:
+            pass
+        raise AttributeError(attr)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        return iter(self.to_insts())
+
+    def __getitem__(self, idx):
+        '''
+        An integer index decodes a single instruction, anything else numpy
+        accepts (slices, masks, index arrays) selects a sub array.
+        '''
+        if isinstance(idx, (int, np.integer)):
+            return type(self).assembler.disassemble(int(self._words[idx]))
+        return type(self)(self._words[idx])
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return np.array_equal(self._words, other._words)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._words!r})'
+
+
+def _column_words(cls, key, column, dtype) -> np.ndarray:
+    field = cls.adt_t.field_dict[key]
+    sub_t = cls.sub_t(key)
+    if isinstance(column, AssembledADTArray):
+        if type(column) is not sub_t:
+            raise TypeError(f'expected {sub_t} for {key} not {type(column)}')
+        words = column.words
+    elif sub_t is None:
+        width = cls.assembler_t(field).width
+        if not isinstance(column, np.ndarray):
+            # Bits and BitVectors are sequences themselves
+            column = [int(v) for v in column]
+        words = np.asarray(column, dtype=_words_dtype(width))
+        _check_fits(words, width, f'column {key}')
+    else:
+        words = sub_t.from_insts(column).words
+    return words.astype(dtype)
+
+
+def _padding(assembler, ranges) -> int:
+    '''
+    Mask of the bits of assembler.width not covered by ranges.
+    '''
+    mask = (1 << assembler.width) - 1
+    for lo, hi in ranges:
+        mask &= ~((1 << hi) - (1 << lo))
+    return mask
+
+
+def _check_fits(words: np.ndarray, width: int, what: str):
+    if not _fits(words, width).all():
+        raise ValueError(f'{what} does not fit in {width} bits')
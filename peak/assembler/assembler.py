@@ -3,38 +3,146 @@ from hwtypes import AbstractBitVector, AbstractBit, BitVector, Bit
 from hwtypes.adt import Enum, Product, Sum, Tuple
 from hwtypes.adt_meta import BoundMeta, EnumMeta
 
-from types import MappingProxyType
+import builtins
+import os
+from types import FunctionType, MappingProxyType
 import typing as tp
+import weakref
+
+import numpy as np
 
 from .assembler_util import _issubclass
+from .cache import LRUCache, CacheInfo
+from .decode_table import DecodeTable, DECODE_TABLE_MAX_WIDTH, INVALID
+from .layout_cache import fingerprint, get_layout_cache, set_layout_cache
+from .layout_cache import sum_fields
+from .encoding import enum_codes, get_encoding
+
+class _MISSING: pass
+
+# Enums up to this width check codes with a boolean table indexed by word
+_CODE_TABLE_MAX_WIDTH = 16
+
+class _Structure:
+    '''
+    Tables shared by every Assembler whose isa has the same fingerprint,
+    e.g. one ISA rebound into several families.  Only the parts which do not
+    depend on the concrete leaf types live here, each Assembler still builds
+    its own values.
+    '''
+    def __init__(self, record: dict, override: bool = False):
+        self.record = record
+        # built from a set_encoding record, never written to the layout cache
+        self.override = override
+        # name -> (source, code object) of generated functions
+        self.codes = {}
+        # raw array of the DecodeTable, see enable_decode_table
+        self.table = None
+
+# Kept alive by the assemblers which use them
+_structures = weakref.WeakValueDictionary()
 
 class Assembler(AbstractAssembler):
+    # generated on first use for Tuple, Product and Sum, see __getattr__
     _asm : tp.Callable[['isa'], int]
     _dsm : tp.Callable[[int], 'isa']
     _width : int
     _layout : tp.Mapping[str, tp.Tuple[int, int]]
+    _decode_cache : tp.Optional[LRUCache] = None
+    _decode_table : tp.Optional[DecodeTable] = None
+    _structure : tp.Optional[_Structure] = None
+    # valid Enum codes, see _valid_codes
+    _code_table : tp.Optional[np.ndarray] = None
 
     def __init__(self, isa: BoundMeta):
         super().__init__(isa)
+        leaf = _issubclass(isa, (AbstractBit, AbstractBitVector))
+        layout_cache = get_layout_cache()
+        structure = None
+        record = None
+        if not leaf:
+            fp = fingerprint(isa)
+            record = override = get_encoding(fp)
+            structure = _structures.get(fp)
+            if structure is not None and not (
+                    _matches(structure.record, override) if override is not None
+                    else not structure.override):
+                # the encoding changed since structure was built
+                structure = None
+            if structure is not None:
+                record = structure.record
+            elif record is None and layout_cache is not None:
+                record = layout_cache.get(fp)
+        codes = structure.codes if structure is not None else {}
+
         if _issubclass(isa, Enum):
-            asm, dsm, width, layout = _enum(isa)
+            asm, dsm, width, layout, *enum_args = _enum(isa, record)
+            self._opcode_2_inst = enum_args[0]
         elif _issubclass(isa, (Tuple, Product)):
-            asm, dsm, width, layout = _tuple(isa)
+            build, width, layout = _tuple(isa, record, codes)
         elif _issubclass(isa, Sum):
-            asm, dsm, width, layout, *tag_args = _sum(isa)
+            build, width, layout, *tag_args = _sum(isa, record)
             self._tag_asm = tag_args[0]
             self._tag_dsm = tag_args[1]
             self._tag_width = tag_args[2]
             self._tag_layout = tag_args[3]
-        elif _issubclass(isa, (AbstractBit, AbstractBitVector)):
+            self._tag_2_field = tag_args[4]
+        elif leaf:
             asm, dsm, width, layout = _field(isa)
         else:
             raise TypeError(f'isa: {isa}')
-        self._asm = asm
-        self._dsm = dsm
+        if _issubclass(isa, (Enum, AbstractBit, AbstractBitVector)):
+            self._asm = asm
+            self._dsm = dsm
+        else:
+            self._build = build
         self._width = width
         self._layout = layout
 
+        if leaf:
+            return
+        if structure is None:
+            structure = _Structure(self._layout_record(), override is not None)
+            # shared with the functions generated later on
+            structure.codes = codes
+            _structures[fp] = structure
+        self._structure = structure
+        # The cache only holds default encodings, other processes read it
+        # without the override
+        if (layout_cache is not None and not structure.override
+                and layout_cache.get(fp) is None):
+            layout_cache.put(fp, structure.record)
+
+    def __getattr__(self, attr):
+        # Generating the functions of every sub-assembler up front would
+        # make construction of large isas slow, build them on first use
+        if attr in ('_asm', '_dsm'):
+            build = self.__dict__.pop('_build', None)
+            if build is not None:
+                self._asm, self._dsm = build()
+                return getattr(self, attr)
+        raise AttributeError(attr)
+
+    def _layout_record(self) -> dict:
+        '''
+        json serializable form of the layout, see layout_cache
+        '''
+        isa = self.isa
+        record = {'width': self.width}
+        if _issubclass(isa, Enum):
+            # from the members, not _opcode_2_inst, so aliases keep their code
+            record['codes'] = {inst._name_: self._asm(inst)
+                    for inst in isa.enumerate()}
+        elif _issubclass(isa, (Tuple, Product)):
+            record['layout'] = [self.layout[name] for name in isa.field_dict]
+        elif _issubclass(isa, Sum):
+            # tags are listed in sum_fields order
+            field_2_tag = {field: tag for tag, field in self._tag_2_field.items()}
+            fields = sum_fields(isa)
+            record['tags'] = [field_2_tag[field] for field in fields]
+            record['layout'] = [self.layout[field] for field in fields]
+        return record
+
     @property
     def width(self) -> int:
         return self._width
@@ -50,8 +158,215 @@ class Assembler(AbstractAssembler):
         assert opcode.bit_length() <= self.width, (opcode, self.width)
         return bv_type[self.width](opcode)
 
-    def disassemble(self, opcode: BitVector) -> 'isa':
-        return self._dsm(opcode)
+    def disassemble(self, opcode: tp.Union[AbstractBitVector, int, bytes]) -> 'isa':
+        '''
+        opcode may be a BitVector, a python int or little endian bytes.
+        Decoding never builds intermediate BitVectors, only the leaves.
+        '''
+        opcode = _as_int(opcode, self.width)
+        table = self._decode_table
+        if table is not None:
+            inst = table[opcode]
+            if inst is INVALID:
+                raise KeyError(opcode)
+            return inst
+        cache = self._decode_cache
+        if cache is None:
+            return self._dsm(opcode)
+        inst = cache.get(opcode, _MISSING)
+        if inst is _MISSING:
+            inst = cache[opcode] = self._dsm(opcode)
+        return inst
+
+    def enable_decode_cache(self, maxsize: tp.Optional[int] = 1024):
+        '''
+        Memoize disassemble on the raw opcode in a bounded LRU cache.
+        Safe because adt values are immutable.
+        '''
+        self._decode_cache = LRUCache(maxsize)
+
+    def disable_decode_cache(self):
+        self._decode_cache = None
+
+    def decode_cache_info(self) -> tp.Optional[CacheInfo]:
+        cache = self._decode_cache
+        if cache is None:
+            return None
+        return cache.info()
+
+    def enable_decode_table(self,
+            path: tp.Optional[str] = None,
+            max_width: int = DECODE_TABLE_MAX_WIDTH) -> DecodeTable:
+        '''
+        Decode through a dense table over the whole opcode space.
+        If path holds a table of this isa it is memory mapped from there,
+        otherwise the table is built (or shared with a structurally
+        identical assembler) and, if path is given, saved there.
+        '''
+        structure = self._structure
+        table = None
+        if path is not None and os.path.exists(path):
+            try:
+                table = DecodeTable.load(self, path)
+            except ValueError:
+                # stale table of another isa, replaced below
+                pass
+        if table is None:
+            if structure is not None and structure.table is not None:
+                table = DecodeTable(self, structure.table)
+            else:
+                table = DecodeTable.build(self, max_width)
+            if path is not None:
+                table.save(path)
+        if structure is not None and structure.table is None:
+            structure.table = table.table
+        self._decode_table = table
+        return table
+
+    def disable_decode_table(self):
+        self._decode_table = None
+
+    @property
+    def decode_table(self) -> tp.Optional[DecodeTable]:
+        return self._decode_table
+
+    def assemble_many(self, insts: tp.Iterable['isa']) -> np.ndarray:
+        '''
+        Assembles a whole program into an array of opcodes.
+        Returns a uint64 array if width <= 64 otherwise an object array of
+        python ints.
+        '''
+        dtype = _words_dtype(self.width)
+        if dtype is object:
+            return np.array([self._asm(inst) for inst in insts], dtype=object)
+        return np.fromiter(map(self._asm, insts), dtype=dtype)
+
+    def disassemble_many(self, words: tp.Iterable[int]) -> tp.List['isa']:
+        '''
+        Inverse of assemble_many.  Fields are extracted column-wise from the
+        whole array using the layout.
+        '''
+        words = np.asarray(words, dtype=_words_dtype(self.width))
+        if words.ndim != 1:
+            raise ValueError('expected a 1-d array of opcodes')
+        fits = _fits(words, self.width)
+        if not fits.all():
+            opcode = words[~fits][0]
+            raise ValueError(f'opcode {opcode} does not fit in {self.width} bits')
+        return self._dsm_many(words)
+
+    def _dsm_many(self, words: np.ndarray) -> tp.List['isa']:
+        isa = self.isa
+        if _issubclass(isa, (Tuple, Product)):
+            columns = []
+            for name, field in isa.field_dict.items():
+                lo, hi = self.layout[name]
+                sub_words = _extract(words, lo, hi)
+                columns.append(Assembler(field)._dsm_many(sub_words))
+            return list(map(isa, *columns))
+        elif _issubclass(isa, Sum):
+            tags = _extract(words, *self.tag_layout)
+            invalid = ~np.isin(tags, list(self._tag_2_field))
+            if invalid.any():
+                raise KeyError(int(tags[invalid][0]))
+            insts = [None] * len(words)
+            for tag, field in self._tag_2_field.items():
+                idxs = np.flatnonzero(tags == tag)
+                if not len(idxs):
+                    continue
+                sub_words = _extract(words[idxs], *self.layout[field])
+                sub_insts = Assembler(field)._dsm_many(sub_words)
+                for i, sub_inst in zip(idxs.tolist(), sub_insts):
+                    insts[i] = isa(sub_inst)
+            return insts
+        else:
+            return list(map(self._dsm, words.tolist()))
+
+    def _canonical_many(self, words: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns (valid, canonical) where valid marks the words that decode to
+        an instruction and canonical is the opcode that instruction assembles
+        to (i.e. with all padding bits cleared).
+        '''
+        isa = self.isa
+        t = words.dtype.type
+        if _issubclass(isa, (Tuple, Product)):
+            valid = np.ones(len(words), dtype=bool)
+            canonical = np.zeros_like(words)
+            for name, field in isa.field_dict.items():
+                lo, hi = self.layout[name]
+                sub_valid, sub_canonical = Assembler(field)._canonical_many(_extract(words, lo, hi))
+                valid &= sub_valid
+                canonical |= sub_canonical << t(lo)
+            return valid, canonical
+        elif _issubclass(isa, Sum):
+            tags = _extract(words, *self.tag_layout)
+            valid = np.zeros(len(words), dtype=bool)
+            canonical = np.zeros_like(words)
+            for tag, field in self._tag_2_field.items():
+                match = tags == t(tag)
+                sub_valid, sub_canonical = Assembler(field)._canonical_many(_extract(words, *self.layout[field]))
+                valid |= match & sub_valid
+                canonical = np.where(match, t(tag) | (sub_canonical << t(self.tag_width)), canonical)
+            return valid, canonical
+        elif _issubclass(isa, Enum):
+            return self._valid_codes(words), words.copy()
+        else:
+            return np.ones(len(words), dtype=bool), words.copy()
+
+    def _valid_codes(self, words: np.ndarray) -> np.ndarray:
+        '''
+        Marks the words (< 2**width) which are codes of the Enum isa.  Small
+        Enums index a boolean table, wide ones fall back to isin.
+        '''
+        table = self._code_table
+        if table is None:
+            codes = list(self._opcode_2_inst)
+            if self.width <= _CODE_TABLE_MAX_WIDTH:
+                table = np.zeros(1 << self.width, dtype=bool)
+                table[codes] = True
+            else:
+                table = np.array(codes, dtype=_words_dtype(self.width))
+            self._code_table = table
+        if table.dtype == bool:
+            return table[words.astype(np.intp)]
+        return np.isin(words, table)
+
+    def valid_mask(self, words: tp.Iterable[int], strict: bool = False) -> np.ndarray:
+        '''
+        Boolean array marking the words which disassemble to an instruction,
+        without raising for the others.  Words with an unused Sum tag or
+        Enum code or with bits above width are invalid.  strict also
+        rejects nonzero padding, i.e. words which are not exactly what
+        their instruction assembles to.
+        '''
+        words = np.asarray(words, dtype=_words_dtype(self.width))
+        if words.ndim != 1:
+            raise ValueError('expected a 1-d array of opcodes')
+        fits = _fits(words, self.width)
+        if not fits.all():
+            words = np.where(fits, words, words.dtype.type(0))
+        valid, canonical = self._canonical_many(words)
+        valid &= fits
+        if strict:
+            valid &= canonical == words
+        return valid
+
+    def is_valid(self, opcode: tp.Union[AbstractBitVector, int, bytes], strict: bool = False) -> bool:
+        '''
+        Scalar valid_mask.  Uses the decode table when it is enabled.
+        '''
+        try:
+            opcode = _as_int(opcode, self.width)
+        except ValueError:
+            return False
+        table = self._decode_table
+        if table is None:
+            return bool(self.valid_mask([opcode], strict)[0])
+        inst = table[opcode]
+        if inst is INVALID:
+            return False
+        return not strict or self._asm(inst) == opcode
 
     def assemble_tag(self, T: type, bv_type: tp.Type[AbstractBitVector]) -> AbstractBitVector:
         if not _issubclass(self.isa, Sum):
@@ -60,10 +375,10 @@ class Assembler(AbstractAssembler):
             raise TypeError(f'{T} is not a member of {self._asm}')
         return bv_type[self.tag_width](self._tag_asm(T))
 
-    def disassemble_tag(self, tag: BitVector) -> 'T':
+    def disassemble_tag(self, tag: tp.Union[AbstractBitVector, int, bytes]) -> 'T':
         if not _issubclass(self.isa, Sum):
             raise TypeError('can only disassemble tag for Sum')
-        return self._tag_dsm(tag)
+        return self._tag_dsm(_as_int(tag, self.tag_width))
 
     @property
     def tag_width(self) -> int:
@@ -81,101 +396,99 @@ class Assembler(AbstractAssembler):
         return f'{type(self)}({self.isa})'
 
 
-def _enum(isa : Enum) -> int:
+def _enum(isa : Enum, record : tp.Optional[dict] = None) -> int:
     asm = {}
     dsm = {}
     layout = {}
 
-    free  = []
-    used  = set()
-    i_map = {}
-    for inst in isa.enumerate():
-        val = inst._value_
-        if isinstance(val, int):
-            used.add(val)
-            i_map[inst] = val
-        else:
-            assert isinstance(val, EnumMeta.Auto)
-            free.append(inst)
-    c = 0
-    while free:
-        inst = free.pop()
-        while c in used:
-            c += 1
-        used.add(c)
-        i_map[inst] = c
-
-    width = max(used).bit_length()
+    if record is not None:
+        codes = record['codes']
+        i_map = {inst: codes[inst._name_] for inst in isa.enumerate()}
+        width = record['width']
+    else:
+        i_map, width = enum_codes(isa)
+
     for inst in isa.enumerate():
         layout[inst] = (0, width)
         opcode = i_map[inst]
         asm[inst] = opcode
         dsm[opcode] = inst
 
-    def assembler(inst):
-        return asm[inst]
+    # Bound lookups so generated code can call them without a closure
+    return asm.__getitem__, dsm.__getitem__, width, layout, MappingProxyType(dsm)
 
-    def disassembler(opcode):
-        return dsm[opcode]
 
-    return assembler, disassembler, width, layout
-
-
-def _tuple(isa : Tuple) -> int:
+def _tuple(isa : Tuple,
+        record : tp.Optional[dict] = None,
+        codes : tp.Optional[dict] = None) -> int:
     layout = {}
-    base = 0
-    for name,field in isa.field_dict.items():
-        field_width = Assembler(field).width
-        layout[name] = _, base = (base, base + field_width)
-
-    width = base
-
-    def assembler(inst):
-        opcode = 0
+    if record is not None:
+        for name, (lo, hi) in zip(isa.field_dict, record['layout']):
+            layout[name] = (lo, hi)
+        width = record['width']
+    else:
+        base = 0
         for name,field in isa.field_dict.items():
-            assembler = Assembler(field)
-            v = assembler._asm(inst.value_dict[name])
-            opcode |= v << layout[name][0]
-        return opcode
+            field_width = Assembler(field).width
+            layout[name] = _, base = (base, base + field_width)
+        width = base
 
-    def disassembler(opcode):
-        args = []
-        for name,field in isa.field_dict.items():
-            idx = slice(*layout[name])
-            args.append(Assembler(field).disassemble(opcode[idx]))
-        return isa(*args)
+    def build():
+        gen = _Codegen(isa)
+        asm_terms = gen.asm_terms(isa, 'inst', 0, layout)
+        dsm_expr = gen.dsm_expr(isa, 'opcode', 0, layout)
+        assembler = gen.compile('assembler', 'inst',
+                ' | '.join(asm_terms) if asm_terms else '0', codes)
+        disassembler = gen.compile('disassembler', 'opcode', dsm_expr, codes)
+        return assembler, disassembler
 
-    return assembler, disassembler, width, layout
+    return build, width, layout
 
 
-def _sum(isa : Sum) -> int:
+def _sum(isa : Sum, record : tp.Optional[dict] = None) -> int:
     tag_2_field = {}
     field_2_tag = {}
     layout = {}
     tag_width = (len(isa.fields)-1).bit_length()
-
-    width = 0
-    for tag, field in enumerate(sorted(isa.fields, key=lambda field: (field.__name__, field.__module__))):
-        field_width = Assembler(field).width
+    tag_mask = (1 << tag_width) - 1
+
+    fields = sum_fields(isa)
+    if record is not None and 'layout' in record:
+        tags = record['tags']
+        for field, (lo, hi) in zip(fields, record['layout']):
+            layout[field] = (lo, hi)
+        width = record['width']
+    else:
+        if record is not None and 'tags' in record:
+            tags = record['tags']
+        else:
+            tags = range(len(fields))
+        width = 0
+        for field in fields:
+            layout[field] = _, w = (tag_width, tag_width + Assembler(field).width)
+            width = max(width, w)
+    for tag, field in zip(tags, fields):
         tag_2_field[tag] = field
         field_2_tag[field] = tag
-        layout[field] = _, w = (tag_width, tag_width + field_width)
-        width = max(width, w)
-
-    def assembler(inst):
-        v = inst._value_
-        field = type(v)
-        pay_load = Assembler(field)._asm(v)
-        opcode = field_2_tag[field]
-        opcode |= pay_load << tag_width
-        return opcode
-
-    def disassembler(opcode):
-        tag = opcode[0:tag_width].as_uint()
-        field = tag_2_field[tag]
-        pay_load = opcode[slice(*layout[field])]
-        inst = isa(Assembler(field).disassemble(pay_load))
-        return inst
+
+    def build():
+        asm_dispatch = {}
+        dsm_dispatch = {}
+        for field, tag in field_2_tag.items():
+            sub_assembler = Assembler(field)
+            asm_dispatch[field] = tag, sub_assembler._asm
+            dsm_dispatch[tag] = sub_assembler._dsm, (1 << sub_assembler.width) - 1
+
+        def assembler(inst):
+            v = inst._value_
+            tag, sub_asm = asm_dispatch[type(v)]
+            return tag | sub_asm(v) << tag_width
+
+        def disassembler(opcode):
+            sub_dsm, mask = dsm_dispatch[opcode & tag_mask]
+            return isa(sub_dsm(opcode >> tag_width & mask))
+
+        return assembler, disassembler
 
     def tag_assembler(T):
         return field_2_tag[T]
@@ -183,8 +496,13 @@ def _sum(isa : Sum) -> int:
     def tag_dissambler(tag):
         return tag_2_field[tag]
 
-    return (assembler, disassembler, width, layout,
-            tag_assembler, tag_dissambler, tag_width, (0, tag_width))
+    return (build, width, layout,
+            tag_assembler, tag_dissambler, tag_width, (0, tag_width),
+            MappingProxyType(tag_2_field))
+
+
+def _matches(record: dict, partial: dict) -> bool:
+    return all(record.get(k) == v for k, v in partial.items())
 
 
 def _field(isa : tp.Type[AbstractBitVector]):
@@ -195,8 +513,115 @@ def _field(isa : tp.Type[AbstractBitVector]):
     else:
         raise TypeError()
     layout = {}
-    def assembler(inst):
-        return int(inst)
-    def disassembler(opcode):
-        return isa(opcode)
-    return assembler, disassembler, width, layout
+    return int, isa, width, layout
+
+
+def _as_int(opcode, width: int) -> int:
+    if isinstance(opcode, (bytes, bytearray, memoryview)):
+        opcode = int.from_bytes(opcode, 'little')
+    elif not isinstance(opcode, int):
+        opcode = int(opcode)
+    if opcode < 0 or opcode.bit_length() > width:
+        raise ValueError(f'opcode {opcode} does not fit in {width} bits')
+    return opcode
+
+
+def _words_dtype(width: int):
+    if width <= 64:
+        return np.uint64
+    return object
+
+
+def _fits(words: np.ndarray, width: int) -> np.ndarray:
+    if words.dtype == object:
+        return np.fromiter((0 <= w and not w >> width for w in words), dtype=bool, count=len(words))
+    elif width < 64:
+        return (words >> np.uint64(width)) == 0
+    return np.ones(len(words), dtype=bool)
+
+
+def _extract(words: np.ndarray, lo: int, hi: int) -> np.ndarray:
+    # Build the constants in the array's own scalar type so uint64 arrays
+    # stay uint64 and object arrays keep arbitrary precision python ints
+    t = words.dtype.type
+    if lo:
+        words = words >> t(lo)
+    return words & t((1 << (hi - lo)) - 1)
+
+
+class _Codegen:
+    '''
+    Flattens an ISA into straight-line python.
+
+    Product / Tuple fields are inlined all the way down so every leaf becomes
+    a single shift/mask term.  Sum and Enum leaves call into the (already
+    compiled) sub-assembler, which is bound once into the generated code's
+    namespace.
+    '''
+    def __init__(self, isa):
+        self.isa = isa
+        self.env = {'__builtins__': builtins}
+        self._names = {}
+
+    def bind(self, obj) -> str:
+        try:
+            return self._names[id(obj)]
+        except KeyError:
+            pass
+        name = f'_{len(self._names)}'
+        self._names[id(obj)] = name
+        self.env[name] = obj
+        return name
+
+    def asm_terms(self, isa, value, offset, layout=None) -> tp.List[str]:
+        if layout is None:
+            layout = Assembler(isa).layout
+        terms = []
+        for idx, (name, field) in enumerate(isa.field_dict.items()):
+            sub_value = f'{value}._value_[{idx}]'
+            sub_offset = offset + layout[name][0]
+            if _issubclass(field, (Tuple, Product)):
+                terms.extend(self.asm_terms(field, sub_value, sub_offset))
+                continue
+            elif _issubclass(field, (AbstractBit, AbstractBitVector)):
+                term = f'int({sub_value})'
+            else:
+                term = f'{self.bind(Assembler(field)._asm)}({sub_value})'
+            if sub_offset:
+                term = f'{term} << {sub_offset}'
+            terms.append(term)
+        return terms
+
+    def dsm_expr(self, isa, opcode, offset, layout=None) -> str:
+        if layout is None:
+            layout = Assembler(isa).layout
+        args = []
+        for name, field in isa.field_dict.items():
+            lo, hi = layout[name]
+            lo += offset
+            hi += offset
+            if _issubclass(field, (Tuple, Product)):
+                args.append(self.dsm_expr(field, opcode, lo))
+                continue
+            bits = f'{opcode} >> {lo}' if lo else opcode
+            bits = f'{bits} & {hex((1 << (hi - lo)) - 1)}'
+            args.append(f'{self.bind(Assembler(field)._dsm)}({bits})')
+        return f'{self.bind(isa)}({", ".join(args)})'
+
+    def compile(self, name, arg, expr, codes=None):
+        '''
+        codes caches compiled functions by name.  Structurally identical isas
+        generate identical source (names in env are bound in traversal order)
+        so only env differs between them.
+        '''
+        src = f'def {name}({arg}):\n    return {expr}\n'
+        if codes is not None:
+            cached_src, code = codes.get(name, (None, None))
+            if cached_src == src:
+                return FunctionType(code, self.env, name)
+        mod = compile(src, f'<{name} for {self.isa}>', 'exec')
+        exec(mod, self.env)
+        f = self.env.pop(name)
+        if codes is not None:
+            codes[name] = src, f.__code__
+        return f
@@ -8,17 +8,74 @@ import warnings
 import weakref
 
 from .assembler_util import _issubclass
+from .cache import LRUCache, CacheInfo
+
+DEFAULT_CACHE_SIZE = 1024
+
+class _MISSING: pass
+
+class _InstanceCache:
+    '''
+    Keeps the maxsize most recently used instances alive.  Older instances
+    are only weakly referenced so they (and the isa types they reference)
+    can be collected once nothing else uses them.
+    '''
+    def __init__(self, maxsize: tp.Optional[int] = DEFAULT_CACHE_SIZE):
+        self._strong = LRUCache(maxsize)
+        self._weak = weakref.WeakValueDictionary()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, idx):
+        obj = self._strong.get(idx, _MISSING)
+        if obj is _MISSING:
+            obj = self._weak.get(idx, _MISSING)
+            if obj is _MISSING:
+                self._misses += 1
+                return _MISSING
+            self._strong[idx] = obj
+        self._hits += 1
+        return obj
+
+    def put(self, idx, obj):
+        self._strong[idx] = obj
+        try:
+            self._weak[idx] = obj
+        except TypeError:
+            # not weakly referencable
+            pass
+
+    def resize(self, maxsize: tp.Optional[int]):
+        old = self._strong
+        self._strong = LRUCache(maxsize)
+        for idx, obj in old.items():
+            self._strong[idx] = obj
+
+    def clear(self):
+        self._strong = LRUCache(self._strong.maxsize)
+        self._weak.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self._hits,
+            self._misses,
+            self._strong.info().evictions,
+            self._strong.maxsize,
+            len(self._weak),
+        )
 
 # Basically just handles instance caching
 class AssemblerMeta(ABCMeta):
-    # cls -> ((init args -> object) | None)
+    # cls -> (_InstanceCache | None)
     _cache = dict()
-    def __new__(mcs, name, bases, namespace, cache=True, **kwargs):
+    def __new__(mcs, name, bases, namespace, cache=True, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
         return super().__new__(mcs, name, bases, namespace, **kwargs)
 
-    def __init__(cls, name, bases, namespace, cache=True, **kwargs):
+    def __init__(cls, name, bases, namespace, cache=True, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
         if cache:
-            type(cls)._cache[cls] = dict()
+            type(cls)._cache[cls] = _InstanceCache(cache_size)
         else:
             type(cls)._cache[cls] = None
 
@@ -28,17 +85,32 @@ class AssemblerMeta(ABCMeta):
         i_cache = type(cls)._cache[cls]
         if i_cache is not None:
             idx = (args, tuple(kwargs.items()))
-            try:
-                return i_cache[idx]
-            except KeyError:
-                pass
-            obj = super().__call__(*args, **kwargs)
-            i_cache[idx] = obj
+            obj = i_cache.get(idx)
+            if obj is _MISSING:
+                obj = super().__call__(*args, **kwargs)
+                i_cache.put(idx, obj)
         else:
             obj = super().__call__(*args, **kwargs)
 
         return obj
 
+    def cache_info(cls) -> tp.Optional[CacheInfo]:
+        i_cache = type(cls)._cache[cls]
+        if i_cache is None:
+            return None
+        return i_cache.info()
+
+    def cache_clear(cls):
+        i_cache = type(cls)._cache[cls]
+        if i_cache is not None:
+            i_cache.clear()
+
+    def set_cache_size(cls, maxsize: tp.Optional[int]):
+        i_cache = type(cls)._cache[cls]
+        if i_cache is None:
+            raise TypeError(f'{cls} does not cache instances')
+        i_cache.resize(maxsize)
+
 class AbstractAssembler(metaclass=AssemblerMeta):
     _isa : BoundMeta
 
@@ -46,7 +118,7 @@ class AbstractAssembler(metaclass=AssemblerMeta):
         self._isa = isa
 
 
-    def __init_subclass__(cls, cache=True, **kwargs):
+    def __init_subclass__(cls, cache=True, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
         super().__init_subclass__(**kwargs)
 
     @property
@@ -0,0 +1,75 @@
+from collections import namedtuple, OrderedDict
+import typing as tp
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+class _MISSING: pass
+
+class LRUCache:
+    '''
+    Bounded mapping which evicts the least recently used entry.
+    maxsize=None makes the cache unbounded.
+    '''
+    def __init__(self, maxsize: tp.Optional[int] = 128):
+        if maxsize is not None and maxsize < 0:
+            raise ValueError(f'maxsize must be non-negative not {maxsize}')
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self._misses += 1
+            return default
+        self._data.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data[key] = value
+        data.move_to_end(key)
+        if self._maxsize is not None:
+            while len(data) > self._maxsize:
+                data.popitem(last=False)
+                self._evictions += 1
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def items(self):
+        return self._data.items()
+
+    def pop(self, key, default=_MISSING):
+        if default is _MISSING:
+            return self._data.pop(key)
+        return self._data.pop(key, default)
+
+    @property
+    def maxsize(self) -> tp.Optional[int]:
+        return self._maxsize
+
+    def clear(self):
+        self._data.clear()
+
+    def reset_stats(self):
+        self._hits = self._misses = self._evictions = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self._hits, self._misses, self._evictions, self._maxsize, len(self._data))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.info()})'
@@ -0,0 +1,124 @@
+import hashlib
+import typing as tp
+
+import numpy as np
+
+from hwtypes import BitVector
+from hwtypes.adt import Enum, Product, Sum, Tuple
+
+from .assembler_util import _issubclass
+
+DECODE_TABLE_MAX_WIDTH = 20
+
+# Entries of the table are canonical opcodes so any value that does not fit
+# in max_width marks an opcode which does not decode
+_TABLE_DTYPE = np.uint32
+_INVALID_OPCODE = np.iinfo(_TABLE_DTYPE).max
+_WIDTH_LIMIT = np.iinfo(_TABLE_DTYPE).bits - 1
+
+class _Invalid:
+    def __repr__(self):
+        return 'INVALID'
+
+INVALID = _Invalid()
+
+class DecodeTable:
+    '''
+    Dense decode table over the whole opcode space of a narrow ISA.
+
+    table[opcode] stores the canonical opcode (padding cleared) of the
+    instruction opcode decodes to.  Instructions are built lazily, once per
+    canonical opcode, so the table itself is just an array of ints which can
+    be saved and memory mapped by later processes.
+    '''
+    def __init__(self, assembler, table: np.ndarray):
+        if table.dtype != _TABLE_DTYPE or table.shape != (1 << assembler.width,):
+            raise ValueError(
+                f'table of {table.dtype}{list(table.shape)} does not match '
+                f'{assembler.isa} of width {assembler.width}')
+        self._assembler = assembler
+        self._table = table
+        self._insts = {}
+
+    @classmethod
+    def build(cls, assembler, max_width: int = DECODE_TABLE_MAX_WIDTH) -> 'DecodeTable':
+        width = assembler.width
+        if width > min(max_width, _WIDTH_LIMIT):
+            raise ValueError(f'{assembler.isa} has width {width} which is too wide for a decode table')
+        words = np.arange(1 << width, dtype=np.uint64)
+        valid, canonical = assembler._canonical_many(words)
+        table = np.where(valid, canonical, _INVALID_OPCODE).astype(_TABLE_DTYPE)
+        return cls(assembler, table)
+
+    @classmethod
+    def load(cls, assembler, path, mmap: bool = True) -> 'DecodeTable':
+        '''
+        Loads a table written by save.  Raises ValueError if it was built
+        for a different isa or encoding, even one of the same width.
+        '''
+        data = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+        size = 1 << assembler.width
+        key = _table_key(assembler)
+        if (data.dtype != _TABLE_DTYPE or data.shape != (size + len(key),)
+                or not np.array_equal(data[size:], key)):
+            raise ValueError(f'{path} is not a decode table of {assembler.isa}')
+        return cls(assembler, data[:size])
+
+    def save(self, path):
+        # The key of the isa is stored after the table, see load
+        data = np.concatenate([np.asarray(self._table), _table_key(self._assembler)])
+        with open(path, 'wb') as f:
+            np.save(f, data, allow_pickle=False)
+
+    @property
+    def assembler(self):
+        return self._assembler
+
+    @property
+    def table(self) -> np.ndarray:
+        return self._table
+
+    def __len__(self):
+        return len(self._table)
+
+    def is_valid(self, opcode: int) -> bool:
+        return self._table[opcode] != _INVALID_OPCODE
+
+    def __getitem__(self, opcode: int) -> tp.Union['isa', _Invalid]:
+        canonical = int(self._table[opcode])
+        if canonical == _INVALID_OPCODE:
+            return INVALID
+        try:
+            return self._insts[canonical]
+        except KeyError:
+            pass
+        inst = self._insts[canonical] = self._assembler._dsm(canonical)
+        return inst
+
+
+def _table_key(assembler) -> np.ndarray:
+    '''
+    Digest of the structure of assembler.isa and of the codes used at every
+    node of it, as an array of table entries.
+    '''
+    h = hashlib.sha256()
+    _digest_isa(type(assembler), assembler.isa, h)
+    return np.frombuffer(h.digest(), dtype='<u4').astype(_TABLE_DTYPE)
+
+
+def _digest_isa(assembler_t, isa, h):
+    assembler = assembler_t(isa)
+    h.update(f'{assembler.width};'.encode())
+    if _issubclass(isa, Enum):
+        for inst in isa.enumerate():
+            h.update(f'{inst._name_}={int(assembler.assemble(inst))};'.encode())
+    elif _issubclass(isa, (Tuple, Product)):
+        for name, field in isa.field_dict.items():
+            h.update(f'{name}:{assembler.layout[name]};'.encode())
+            _digest_isa(assembler_t, field, h)
+    elif _issubclass(isa, Sum):
+        # in tag order, names of the alternatives do not matter
+        tags = {int(assembler.assemble_tag(field, BitVector)): field for field in isa.fields}
+        for tag, field in sorted(tags.items()):
+            h.update(f'{tag}:{assembler.layout[field]};'.encode())
+            _digest_isa(assembler_t, field, h)
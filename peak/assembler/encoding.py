@@ -0,0 +1,157 @@
+import typing as tp
+
+from hwtypes.adt import Enum, Product, Sum, Tuple
+from hwtypes.adt_meta import EnumMeta
+
+from .assembler_util import _issubclass
+from .layout_cache import fingerprint, sum_fields
+
+# (codes, width) -> cost
+Cost = tp.Callable[[tp.Sequence[int], int], float]
+
+# fingerprint -> partial layout record, see set_encoding
+_encodings = {}
+
+# Cost evaluations the search may spend on each Enum or Sum
+DEFAULT_MAX_TRIALS = 10000
+
+def enum_codes(isa: Enum) -> tp.Tuple[tp.Mapping[Enum, int], int]:
+    '''
+    Default encoding of an Enum: user values are kept and Auto values are
+    packed into the lowest free codes.
+    '''
+    free  = []
+    used  = set()
+    i_map = {}
+    for inst in isa.enumerate():
+        val = inst._value_
+        if isinstance(val, int):
+            used.add(val)
+            i_map[inst] = val
+        else:
+            assert isinstance(val, EnumMeta.Auto)
+            free.append(inst)
+    c = 0
+    while free:
+        inst = free.pop()
+        while c in used:
+            c += 1
+        used.add(c)
+        i_map[inst] = c
+
+    width = max(used).bit_length()
+    return i_map, width
+
+
+def decode_cost(codes: tp.Sequence[int], width: int) -> int:
+    '''
+    Number of literals needed to recognise every code.  Unused codes are
+    don't cares so a code only has to be told apart from the other codes,
+    bits are picked greedily until it is.
+    '''
+    total = 0
+    for code in codes:
+        others = [c ^ code for c in codes if c != code]
+        while others:
+            bit = max(range(width), key=lambda i: sum(d >> i & 1 for d in others))
+            others = [d for d in others if not d >> bit & 1]
+            total += 1
+    return total
+
+
+def _optimize_codes(codes: tp.List[int],
+        fixed: tp.AbstractSet[int],
+        width: int,
+        cost: Cost,
+        max_trials: int = DEFAULT_MAX_TRIALS) -> tp.List[int]:
+    '''
+    Local search over codes[i] for i not in fixed.  A move either takes an
+    unused code or swaps with another free alternative, so the width never
+    changes and fixed codes are never touched.  Stops at a local minimum or
+    after max_trials moves have been costed, returning the best codes seen.
+    '''
+    best = cost(codes, width)
+    trials = 0
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(codes)):
+            if i in fixed:
+                continue
+            for code in range(1 << width):
+                if code == codes[i]:
+                    continue
+                trial = list(codes)
+                if code in trial:
+                    j = trial.index(code)
+                    if j in fixed:
+                        continue
+                    trial[j] = codes[i]
+                trial[i] = code
+                if trials >= max_trials:
+                    return codes
+                trials += 1
+                trial_cost = cost(trial, width)
+                if trial_cost < best:
+                    codes, best, improved = trial, trial_cost, True
+    return codes
+
+
+def optimize_encoding(isa,
+        cost: Cost = decode_cost,
+        max_trials: int = DEFAULT_MAX_TRIALS) -> tp.Mapping[str, dict]:
+    '''
+    Picks Enum codes and Sum tags of every node in isa to minimize cost.
+    Widths are kept (they are already minimal) as are user fixed Enum
+    values.  The search evaluates cost at most max_trials times per node,
+    so wide Enums get a good rather than a locally optimal encoding.
+    Returns partial layout records keyed by fingerprint which can be
+    installed with set_encoding.
+    '''
+    encoding = {}
+    def visit(adt_t):
+        if _issubclass(adt_t, (Tuple, Product)):
+            for field in adt_t.field_dict.values():
+                visit(field)
+            return
+        elif not _issubclass(adt_t, (Enum, Sum)):
+            return
+
+        fp = fingerprint(adt_t)
+        if fp in encoding:
+            return
+
+        if _issubclass(adt_t, Enum):
+            i_map, width = enum_codes(adt_t)
+            insts = list(adt_t.enumerate())
+            fixed = {i for i, inst in enumerate(insts) if isinstance(inst._value_, int)}
+            codes = _optimize_codes([i_map[inst] for inst in insts], fixed, width, cost, max_trials)
+            encoding[fp] = {
+                'width': width,
+                'codes': {inst._name_: code for inst, code in zip(insts, codes)},
+            }
+        else:
+            fields = sum_fields(adt_t)
+            width = (len(fields)-1).bit_length()
+            codes = _optimize_codes(list(range(len(fields))), frozenset(), width, cost, max_trials)
+            encoding[fp] = {'tags': codes}
+            for field in fields:
+                visit(field)
+
+    visit(isa)
+    return encoding
+
+
+def set_encoding(encoding: tp.Mapping[str, dict]):
+    '''
+    Installs records from optimize_encoding.  Assemblers built afterwards
+    use them in place of the default encoding, assemblers which already
+    exist keep theirs.
+    '''
+    _encodings.update(encoding)
+
+def get_encoding(fp: str) -> tp.Optional[dict]:
+    return _encodings.get(fp)
+
+def clear_encoding():
+    _encodings.clear()
@@ -0,0 +1,126 @@
+import mmap
+import typing as tp
+
+import numpy as np
+
+from .assembler import Assembler, _MISSING, _words_dtype
+from .cache import LRUCache, CacheInfo
+
+Buffer = tp.Union[bytes, bytearray, memoryview, mmap.mmap]
+
+class InstructionStream(tp.Sequence):
+    '''
+    Read only sequence of the instructions packed in a buffer.  Nothing is
+    copied or decoded up front: an entry is read from the buffer and
+    disassembled when it is indexed, so a program image can be mapped with
+    mmap and handed straight to ROM/RAM or a disassembler.
+
+    Every word takes word_bytes bytes (at least enough to hold
+    assembler.width bits, more for aligned images) starting at byte offset.
+    Bits above the width are ignored.
+    '''
+    def __init__(self,
+            assembler: tp.Union[Assembler, type],
+            buffer: Buffer,
+            word_bytes: tp.Optional[int] = None,
+            byteorder: str = 'little',
+            offset: int = 0,
+            cache: tp.Optional[int] = 0):
+        if not isinstance(assembler, Assembler):
+            assembler = Assembler(assembler)
+        min_bytes = max((assembler.width + 7) // 8, 1)
+        if word_bytes is None:
+            word_bytes = min_bytes
+        elif word_bytes < min_bytes:
+            raise ValueError(f'{assembler.width} bit words do not fit in {word_bytes} bytes')
+        if byteorder not in ('little', 'big'):
+            raise ValueError(f"byteorder must be 'little' or 'big' not {byteorder!r}")
+
+        view = memoryview(buffer)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        if not 0 <= offset <= len(view):
+            raise ValueError(f'offset {offset} is outside of the buffer')
+
+        self._assembler = assembler
+        self._view = view
+        self._word_bytes = word_bytes
+        self._byteorder = byteorder
+        self._offset = offset
+        self._mask = (1 << assembler.width) - 1
+        # word index of every entry, slicing a range keeps it lazy
+        self._indices = range((len(view) - offset) // word_bytes)
+        # raw word -> instruction, cache=0 disables it and None is unbounded
+        self._cache = None if cache == 0 else LRUCache(cache)
+
+    def _with_indices(self, indices: range) -> 'InstructionStream':
+        stream = object.__new__(type(self))
+        stream.__dict__.update(self.__dict__)
+        stream._indices = indices
+        return stream
+
+    @property
+    def assembler(self) -> Assembler:
+        return self._assembler
+
+    @property
+    def word_bytes(self) -> int:
+        return self._word_bytes
+
+    @property
+    def byteorder(self) -> str:
+        return self._byteorder
+
+    def word(self, idx: int) -> int:
+        '''
+        Raw opcode of entry idx.
+        '''
+        start = self._offset + self._indices[idx] * self._word_bytes
+        raw = self._view[start:start + self._word_bytes]
+        return int.from_bytes(raw, self._byteorder) & self._mask
+
+    def words(self) -> np.ndarray:
+        '''
+        Raw opcodes of every entry as an array suitable for
+        Assembler.disassemble_many or AssembledADTArray.
+        '''
+        word_bytes = self._word_bytes
+        dtype = _words_dtype(self._assembler.width)
+        if word_bytes in (1, 2, 4, 8) and dtype is np.uint64:
+            order = '<' if self._byteorder == 'little' else '>'
+            total = (len(self._view) - self._offset) // word_bytes
+            raw = np.frombuffer(self._view, dtype=f'{order}u{word_bytes}',
+                    count=total, offset=self._offset)
+            r = self._indices
+            raw = raw[np.arange(r.start, r.stop, r.step)]
+            return raw.astype(np.uint64) & np.uint64(self._mask)
+        return np.array([self.word(i) for i in range(len(self))], dtype=dtype)
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._with_indices(self._indices[idx])
+        word = self.word(idx)
+        cache = self._cache
+        if cache is None:
+            return self._assembler.disassemble(word)
+        inst = cache.get(word, _MISSING)
+        if inst is _MISSING:
+            inst = cache[word] = self._assembler.disassemble(word)
+        return inst
+
+    def __iter__(self):
+        for i in range(len(self._indices)):
+            yield self[i]
+
+    def cache_info(self) -> tp.Optional[CacheInfo]:
+        cache = self._cache
+        if cache is None:
+            return None
+        return cache.info()
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({self._assembler!r}, <{len(self)} words '
+                f'of {self._word_bytes} bytes, {self._byteorder}>)')
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import typing as tp
+import weakref
+
+from hwtypes import AbstractBitVector, AbstractBit
+from hwtypes.adt import Enum, Product, Sum, Tuple
+from hwtypes.adt_meta import EnumMeta
+
+from .assembler_util import _issubclass
+
+# Bump whenever the signature or the record format changes
+_FORMAT_VERSION = 3
+
+_signatures = weakref.WeakKeyDictionary()
+
+def _signature(adt_t) -> str:
+    try:
+        return _signatures[adt_t]
+    except (KeyError, TypeError):
+        pass
+
+    if _issubclass(adt_t, Enum):
+        members = []
+        for inst in adt_t.enumerate():
+            val = inst._value_
+            if isinstance(val, EnumMeta.Auto):
+                val = '?'
+            members.append(f'{inst._name_}={val}')
+        sig = f'E({",".join(members)})'
+    elif _issubclass(adt_t, (Tuple, Product)):
+        fields = (f'{k}:{_signature(v)}' for k, v in adt_t.field_dict.items())
+        sig = f'T({",".join(fields)})'
+    elif _issubclass(adt_t, Sum):
+        # Only the tag order matters, not the names it was derived from, so
+        # a Sum rebound into another family keeps its signature
+        sig = f'S({",".join(map(_signature, sum_fields(adt_t)))})'
+    elif _issubclass(adt_t, AbstractBitVector):
+        sig = f'BV{adt_t.size}'
+    elif _issubclass(adt_t, AbstractBit):
+        sig = 'B'
+    else:
+        raise TypeError(f'Cannot fingerprint {adt_t}')
+
+    try:
+        _signatures[adt_t] = sig
+    except TypeError:
+        pass
+    return sig
+
+
+def sum_fields(adt_t) -> tp.List[type]:
+    '''
+    Fields of a Sum in tag order.
+    '''
+    return sorted(adt_t.fields, key=lambda field: (field.__name__, field.__module__))
+
+
+def fingerprint(adt_t) -> str:
+    '''
+    Structural fingerprint of an adt type.  Two types with the same
+    fingerprint have the same assembler layout regardless of which family
+    they were built in.
+    '''
+    sig = f'{_FORMAT_VERSION}:{_signature(adt_t)}'
+    return hashlib.sha256(sig.encode()).hexdigest()
+
+
+class LayoutCache:
+    '''
+    Maps fingerprints to assembler layout records.  Records are plain json
+    so they can be shared between processes through directory.
+    '''
+    def __init__(self, directory: tp.Optional[str] = None):
+        self._directory = directory
+        self._records = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> tp.Optional[str]:
+        return self._directory
+
+    def _path(self, fp: str) -> str:
+        return os.path.join(self._directory, f'{fp}.json')
+
+    def get(self, fp: str) -> tp.Optional[dict]:
+        try:
+            return self._records[fp]
+        except KeyError:
+            pass
+        if self._directory is None:
+            return None
+        try:
+            with open(self._path(fp)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._records[fp] = record
+        return record
+
+    def put(self, fp: str, record: dict):
+        self._records[fp] = record
+        if self._directory is None:
+            return
+        # Write then rename so concurrent workers never see partial records
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp, self._path(fp))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self):
+        self._records.clear()
+        if self._directory is None:
+            return
+        for name in os.listdir(self._directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self._directory, name))
+
+    def __len__(self):
+        return len(self._records)
+
+
+_layout_cache = None
+
+def set_layout_cache(directory: tp.Optional[str]) -> tp.Optional[LayoutCache]:
+    '''
+    Directs Assembler to load/store layouts under directory.
+    Passing None disables the cache.  Defaults to $PEAK_LAYOUT_CACHE.
+    '''
+    global _layout_cache
+    if directory is None:
+        _layout_cache = None
+    else:
+        _layout_cache = LayoutCache(directory)
+    return _layout_cache
+
+def get_layout_cache() -> tp.Optional[LayoutCache]:
+    return _layout_cache
+
+set_layout_cache(os.environ.get('PEAK_LAYOUT_CACHE'))
@@ -1,2 +1,4 @@
 from .mapper import *
 from .oldmapper import gen_mapping
+from .parallel import map_ir, MapIRResult
+from .rule_store import RuleStore, set_rule_store, get_rule_store
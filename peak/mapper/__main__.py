@@ -0,0 +1,36 @@
+import argparse
+import os
+
+from .rule_store import RuleStore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m peak.mapper',
+            description='Inspect and maintain a rewrite rule store')
+    parser.add_argument('directory', nargs='?', default=os.environ.get('PEAK_RULE_STORE'))
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('list')
+    inv = sub.add_parser('invalidate')
+    inv.add_argument('--key')
+    inv.add_argument('--arch')
+    inv.add_argument('--ir')
+    vac = sub.add_parser('vacuum')
+    vac.add_argument('--max-age', type=float, help='seconds')
+    args = parser.parse_args(argv)
+    if args.directory is None:
+        parser.error('no directory given and $PEAK_RULE_STORE is not set')
+
+    store = RuleStore(args.directory)
+    if args.cmd == 'list':
+        for key, record in store.entries():
+            result = 'unmappable' if record.get('rule') is None else 'rule'
+            print(f"{key[:16]}  {record.get('arch')}  {record.get('ir')}  "
+                  f"{record.get('key', {}).get('solver')}  {result}")
+    elif args.cmd == 'invalidate':
+        print(f'removed {store.invalidate(args.key, args.arch, args.ir)} records')
+    else:
+        print(f'removed {store.vacuum(args.max_age)} records')
+
+
+if __name__ == '__main__':
+    main()
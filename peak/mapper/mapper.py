@@ -142,10 +142,55 @@ class ArchMapper(SMTMapper):
             path_constraints[path] =constraints
 
         self.path_constraints = path_constraints
+        # solver_name -> SolverSession
+        self._sessions = {}
 
     def process_ir_instruction(self, ir_fc):
         return IRMapper(self, ir_fc)
 
+    def solver_session(self, solver_name: str = 'z3') -> 'SolverSession':
+        '''
+        Solver shared by the IRMappers of this arch, see SolverSession.
+        '''
+        session = self._sessions.get(solver_name)
+        if session is None:
+            session = self._sessions[solver_name] = SolverSession(solver_name)
+        return session
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+class SolverSession:
+    '''
+    Keeps one solver open across instructions.  Every instruction is
+    asserted in its own push/pop scope, so nothing leaks between them, but
+    the solver keeps what it built for the shared arch side: pysmt's
+    translation of the arch output expressions and the solver's own term
+    tables and lemmas.
+    '''
+    def __init__(self, solver_name: str = 'z3'):
+        self.solver_name = solver_name
+        self._solver = smt.Solver(solver_name, logic=BV)
+
+    def solve(self, irmapper: 'IRMapper', constraint=None) -> tp.Union[None, 'RewriteRule']:
+        solver = self._solver
+        solver.push()
+        try:
+            solver.add_assertion(irmapper.formula)
+            if constraint is not None:
+                solver.add_assertion(constraint)
+            if not solver.solve():
+                return None
+            return rr_from_solver(solver, irmapper)
+        finally:
+            solver.pop()
+
+    def close(self):
+        self._solver.exit()
+
 
 class RewriteRule:
     def __init__(self, ibinding, obinding, ir_fc, arch_fc):
@@ -390,22 +435,107 @@ class IRMapper(SMTMapper):
         self.ob_var = ob_var
         self.input_bindings = input_bindings
         self.output_bindings = output_bindings
-        self.formula = smt.ForAll(list(forall_vars), formula.value)
+        self.forall_vars = sorted(forall_vars, key=lambda v: v.symbol_name())
+        self.qf_formula = formula.value
+        self.formula = smt.ForAll(self.forall_vars, self.qf_formula)
 
 
     def solve(self,
         solver_name : str = 'z3',
-        custom_enumeration : tp.Mapping[type, tp.Callable] = {}
+        custom_enumeration : tp.Mapping[type, tp.Callable] = {},
+        incremental : bool = True,
+        cegis : bool = False,
+        presolve : tp.Optional['IRMapper'] = None,
     ) -> tp.Union[None, RewriteRule]:
+        '''
+        Finds a rewrite rule or returns None if there is none.  cegis avoids
+        the quantified formula, see _cegis.
+
+        presolve is the mapping of the same instruction onto the same arch
+        built from closures instantiated at a smaller width.  Only the
+        (form, input binding, output binding) candidates which have a
+        solution there are tried, see map_reduced.
+        '''
         if not self.has_bindings:
             return None
 
-        with smt.Solver(solver_name, logic=BV) as solver:
-            solver.add_assertion(self.formula)
-            is_solved = solver.solve()
-            if not is_solved:
+        from .rule_store import get_rule_store
+        store = get_rule_store()
+        if store is not None:
+            found, rr = store.lookup(self, solver_name)
+            if found:
+                return rr
+
+        constraint = None
+        if presolve is not None:
+            candidates = self._translate_candidates(presolve, presolve.candidates(solver_name))
+            if not candidates:
+                # Not a proof, keep it out of the store
                 return None
-            return rr_from_solver(solver, self)
+            constraint = or_reduce(self._select(*c) for c in candidates).value
+
+        if cegis:
+            rr = _cegis(self, solver_name, constraint)
+        elif incremental:
+            rr = self.archmapper.solver_session(solver_name).solve(self, constraint)
+        else:
+            rr = _solve(self, solver_name, constraint)
+        if store is not None and (rr is not None or presolve is None):
+            store.record(self, solver_name, rr)
+        return rr
+
+    def candidates(self,
+        solver_name : str = 'z3',
+        cegis : bool = True,
+    ) -> tp.List[tp.Tuple[int, int, int]]:
+        '''
+        Every (input form, input binding, output binding) index triple for
+        which there is a rewrite rule.  Enumerating needs proofs that the
+        remaining triples have none, which z3 often cannot find for the
+        quantified formula even at a few bits, so cegis is the default.
+        '''
+        if not self.has_bindings:
+            return []
+        found = []
+        while True:
+            blocked = None
+            if found:
+                blocked = and_reduce(~self._select(*c) for c in found).value
+            if cegis:
+                c = _cegis(self, solver_name, blocked, _selection)
+            else:
+                c = _solve(self, solver_name, blocked, _selection)
+            if c is None:
+                return found
+            found.append(c)
+
+    def _select(self, fi, bi, bo):
+        am = self.archmapper
+        return (am.input_form_var == 2**fi) & (self.ib_var == 2**bi) & (self.ob_var == 2**bo)
+
+    def _translate_candidates(self, other: 'IRMapper', candidates):
+        '''
+        Maps candidates of other onto the bindings of self.  Bindings are
+        matched by their paths, with Sum alternatives identified by their
+        index, as types differ between widths.
+        '''
+        if other.archmapper.num_input_forms != self.archmapper.num_input_forms:
+            raise ValueError('presolve arch does not have the same input forms')
+        other_sigs, self_sigs = _binding_signatures(other), _binding_signatures(self)
+        ib_idx = [{sig: bi for bi, sig in enumerate(sigs)} for sigs in self_sigs[0]]
+        ob_idx = {sig: bo for bo, sig in enumerate(self_sigs[1])}
+        translated = []
+        for fi, bi, bo in candidates:
+            try:
+                translated.append((
+                    fi,
+                    ib_idx[fi][other_sigs[0][fi][bi]],
+                    ob_idx[other_sigs[1][bo]],
+                ))
+            except KeyError:
+                # e.g. the binding is excluded by a path constraint
+                pass
+        return translated
 
 def _input_aadt_t(fc, family):
     bv = fc(family)
@@ -413,13 +543,112 @@ def _input_aadt_t(fc, family):
     return input_aadt_t
 
 
+def _binding_signatures(irmapper):
+    from .rule_codec import _walk_path
+    def root(fc, input):
+        cls = _get_peak_cls(fc(family.SMTFamily()))
+        return strip_modifiers(cls.input_t if input else cls.output_t)
+    def sig(binding, ir_t, arch_t):
+        return tuple(
+            (None if ir_path is Unbound else _walk_path(ir_t, ir_path, True),
+             _walk_path(arch_t, arch_path, True))
+            for ir_path, arch_path in binding
+        )
+    ir_fc, arch_fc = irmapper.peak_fc, irmapper.archmapper.peak_fc
+    ir_in, arch_in = root(ir_fc, True), root(arch_fc, True)
+    ir_out, arch_out = root(ir_fc, False), root(arch_fc, False)
+    return (
+        [[sig(b, ir_in, arch_in) for b in bindings] for bindings in irmapper.input_bindings],
+        [sig(b, ir_out, arch_out) for b in irmapper.output_bindings],
+    )
+
+
+def map_reduced(arch_gen, ir_gen, width: int, small_width: int = 4, *,
+        solver_name: str = 'z3',
+        path_constraints: tp.Mapping[tuple, tp.Any] = {},
+        cegis: bool = False,
+) -> tp.Union[None, RewriteRule]:
+    '''
+    Maps ir_gen(width) onto arch_gen(width), where the generators return the
+    family closures at a data width, presolving at small_width.
+
+    Solving at a few bits rules out most bindings cheaply so the full width
+    formula is only solved over the candidates left.  This is a heuristic:
+    it assumes a binding which does not work at small_width does not work
+    at width either, which holds when the closures compute the same
+    operations at every width.  path_constraints only apply at width.
+    '''
+    small = ArchMapper(arch_gen(small_width)).process_ir_instruction(ir_gen(small_width))
+    ir_mapper = ArchMapper(arch_gen(width), path_constraints=path_constraints) \
+        .process_ir_instruction(ir_gen(width))
+    if not small.has_bindings:
+        return ir_mapper.solve(solver_name, cegis=cegis)
+    return ir_mapper.solve(solver_name, cegis=cegis, presolve=small)
+
+
+def _solve(irmapper, solver_name, constraint=None, extract=None):
+    with smt.Solver(solver_name, logic=BV) as solver:
+        solver.add_assertion(irmapper.formula)
+        if constraint is not None:
+            solver.add_assertion(constraint)
+        if not solver.solve():
+            return None
+        return (extract or rr_from_solver)(solver, irmapper)
+
+
+def _cegis(irmapper, solver_name, constraint=None, extract=None):
+    '''
+    Counterexample guided synthesis of a model of irmapper.formula.
+    Instead of the quantified formula the synthesis solver is given the
+    quantifier free formula instantiated at a growing set of concrete
+    values of the forall vars.  Each candidate (form, bindings and
+    constants) is checked by the verification solver over all values, a
+    failing value is added as the next example.  An unsatisfiable
+    synthesis query proves there is no rule.
+    '''
+    forall_vars = irmapper.forall_vars
+    body = irmapper.qf_formula
+    exists_vars = [v for v in body.get_free_variables() if v not in set(forall_vars)]
+    example = {v: _zero(v) for v in forall_vars}
+    with smt.Solver(solver_name, logic=BV) as synth, \
+         smt.Solver(solver_name, logic=BV) as verifier:
+        if constraint is not None:
+            synth.add_assertion(constraint)
+        while True:
+            synth.add_assertion(body.substitute(example))
+            if not synth.solve():
+                return None
+            candidate = {v: synth.get_value(v) for v in exists_vars}
+            verifier.push()
+            try:
+                verifier.add_assertion(smt.Not(body.substitute(candidate)))
+                if not verifier.solve():
+                    return (extract or rr_from_solver)(synth, irmapper)
+                example = {v: verifier.get_value(v) for v in forall_vars}
+            finally:
+                verifier.pop()
+
+
+def _zero(var):
+    T = var.symbol_type()
+    if T.is_bv_type():
+        return smt.BV(0, T.width)
+    return smt.FALSE()
+
+
+def _selection(solver, irmapper):
+    return (
+        log2(int(solved_to_bv(irmapper.archmapper.input_form_var, solver))),
+        log2(int(solved_to_bv(irmapper.ib_var, solver))),
+        log2(int(solved_to_bv(irmapper.ob_var, solver))),
+    )
+
+
 def rr_from_solver(solver, irmapper):
     im = irmapper
     am = irmapper.archmapper
 
-    arch_input_form_val = log2(int(solved_to_bv(am.input_form_var, solver)))
-    ib_val = log2(int(solved_to_bv(im.ib_var, solver)))
-    ob_val = log2(int(solved_to_bv(im.ob_var, solver)))
+    arch_input_form_val, ib_val, ob_val = _selection(solver, irmapper)
 
     ibinding = im.input_bindings[arch_input_form_val][ib_val]
     obinding = im.output_bindings[ob_val]
@@ -0,0 +1,82 @@
+from collections import namedtuple
+import multiprocessing
+import os
+import time
+import typing as tp
+
+from .mapper import ArchMapper, RewriteRule
+from .rule_codec import encode_rule, decode_rule, rule_roots
+
+MapIRResult = namedtuple('MapIRResult', ['rules', 'times'])
+
+# Set in the parent before the pool forks so workers inherit the
+# (unpicklable) family closures, see _init_worker
+_job = None
+_arch_mapper = None
+
+def map_ir(arch_fc, ir, workers: tp.Optional[int] = None, *,
+        solver_name: str = 'z3',
+        path_constraints: tp.Mapping[tuple, tp.Any] = {},
+        instructions: tp.Optional[tp.Iterable[str]] = None) -> MapIRResult:
+    '''
+    Maps every instruction of ir (or only those named in instructions) onto
+    arch_fc.  Instructions are solved in a pool of workers processes
+    (default os.cpu_count()), each building its ArchMapper once.  Returns
+    rules (name -> RewriteRule or None) and times (name -> seconds spent
+    building and solving that instruction).
+
+    Family closures cannot be pickled so the pool forks, on platforms
+    without fork or with workers <= 1 everything runs in this process.
+    '''
+    global _job, _arch_mapper
+    names = list(ir.instructions if instructions is None else instructions)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(names))
+    job = arch_fc, ir, solver_name, path_constraints
+
+    rules, times = {}, {}
+    if not names:
+        return MapIRResult(rules, times)
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        arch_mapper = ArchMapper(arch_fc, path_constraints=path_constraints)
+        for name in names:
+            rules[name], times[name] = _solve(arch_mapper, ir.instructions[name], solver_name)
+        return MapIRResult(rules, times)
+
+    _job = job
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(workers, initializer=_init_worker) as pool:
+            for name, rule, t in pool.imap_unordered(_map_one, names):
+                if rule is not None:
+                    ir_fc = ir.instructions[name]
+                    ibinding, obinding = decode_rule(rule, rule_roots(arch_fc, ir_fc))
+                    rule = RewriteRule(ibinding, obinding, ir_fc, arch_fc)
+                rules[name], times[name] = rule, t
+    finally:
+        _job = None
+        _arch_mapper = None
+    return MapIRResult({name: rules[name] for name in names},
+                       {name: times[name] for name in names})
+
+
+def _solve(arch_mapper, ir_fc, solver_name):
+    start = time.perf_counter()
+    rule = arch_mapper.process_ir_instruction(ir_fc).solve(solver_name)
+    return rule, time.perf_counter() - start
+
+
+def _init_worker():
+    global _arch_mapper
+    arch_fc, _, _, path_constraints = _job
+    _arch_mapper = ArchMapper(arch_fc, path_constraints=path_constraints)
+
+
+def _map_one(name):
+    arch_fc, ir, solver_name, _ = _job
+    ir_fc = ir.instructions[name]
+    rule, t = _solve(_arch_mapper, ir_fc, solver_name)
+    if rule is not None:
+        rule = encode_rule(rule, rule_roots(arch_fc, ir_fc))
+    return name, rule, t
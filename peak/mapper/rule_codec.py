@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+from hwtypes import Bit, BitVector
+from hwtypes.adt import Sum
+from hwtypes.modifiers import strip_modifiers
+
+from peak import family
+from peak.assembler.assembler_util import _issubclass
+from peak.assembler.layout_cache import sum_fields
+from .mapper import RewriteRule, _get_peak_cls
+from .utils import Unbound
+
+# Rewrite rules hold hwtypes values and paths through family specific Sum
+# types, neither of which pickle.  Encoded rules only hold strs, ints,
+# None and tuples (lists after a json round trip) so they can be sent to
+# other processes and stored on disk.  Values become ints and a path
+# through a Sum names the alternative by its tag index.  The roots are the
+# types the paths of rr_from_solver start from.
+
+Roots = namedtuple('Roots', ['ir_in', 'arch_in', 'ir_out', 'arch_out'])
+
+def rule_roots(arch_fc, ir_fc) -> Roots:
+    smt, py = family.SMTFamily(), family.PyFamily()
+    def root(fc, fam, attr):
+        return strip_modifiers(getattr(_get_peak_cls(fc(fam)), attr))
+    return Roots(
+        ir_in=root(ir_fc, smt, 'input_t'),
+        arch_in=root(arch_fc, py, 'input_t'),
+        ir_out=root(ir_fc, smt, 'output_t'),
+        arch_out=root(arch_fc, smt, 'output_t'),
+    )
+
+
+def _walk_path(adt_t, path, encode: bool) -> tuple:
+    ret = []
+    for key in path:
+        adt_t = strip_modifiers(adt_t)
+        if _issubclass(adt_t, Sum):
+            fields = sum_fields(adt_t)
+            if encode:
+                key = next(i for i, T in enumerate(fields) if T is strip_modifiers(key))
+                adt_t = fields[key]
+            else:
+                key = adt_t = fields[key]
+        else:
+            adt_t = adt_t.field_dict[key]
+        ret.append(key)
+    return tuple(ret)
+
+
+def _encode_value(value):
+    if isinstance(value, Bit):
+        return 'bit', int(value)
+    elif isinstance(value, BitVector):
+        return 'bv', value.size, value.as_uint()
+    raise TypeError(f'Cannot encode binding value {value!r}')
+
+
+def _decode_value(value):
+    kind, *args = value
+    if kind == 'bit':
+        return Bit(*args)
+    elif kind == 'bv':
+        size, val = args
+        return BitVector[size](val)
+    raise ValueError(f'Unknown value kind {kind!r}')
+
+
+def encode_rule(rule: RewriteRule, roots: Roots):
+    ibinding = []
+    for ir_path, arch_path in rule.ibinding:
+        if isinstance(ir_path, tuple):
+            ir_path = 'path', _walk_path(roots.ir_in, ir_path, True)
+        else:
+            ir_path = _encode_value(ir_path)
+        ibinding.append((ir_path, _walk_path(roots.arch_in, arch_path, True)))
+    obinding = []
+    for ir_path, arch_path in rule.obinding:
+        if ir_path is Unbound:
+            ir_path = None
+        else:
+            ir_path = _walk_path(roots.ir_out, ir_path, True)
+        obinding.append((ir_path, _walk_path(roots.arch_out, arch_path, True)))
+    return ibinding, obinding
+
+
+def decode_rule(rule, roots: Roots):
+    ibinding, obinding = rule
+    ibinding = [
+        (_walk_path(roots.ir_in, ir_path[1], False) if ir_path[0] == 'path' else _decode_value(ir_path),
+         _walk_path(roots.arch_in, arch_path, False))
+        for ir_path, arch_path in ibinding
+    ]
+    obinding = [
+        (Unbound if ir_path is None else _walk_path(roots.ir_out, ir_path, False),
+         _walk_path(roots.arch_out, arch_path, False))
+        for ir_path, arch_path in obinding
+    ]
+    return ibinding, obinding
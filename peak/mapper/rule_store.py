@@ -0,0 +1,379 @@
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+import types
+import typing as tp
+import weakref
+
+from hwtypes import Bit, BitVector
+
+import peak
+from peak.features import family_closure
+from .mapper import RewriteRule
+from .rule_codec import encode_rule, decode_rule, rule_roots
+
+# Bump whenever the key or the record format changes
+_FORMAT_VERSION = 3
+
+# Module level objects of these packages are identified by name only.
+# peak itself is covered by the digest of its sources, see _peak_digest
+_LIBRARY_MODULES = ('builtins', 'typing', 'peak', 'hwtypes', 'magma', 'pysmt', 'ast_tools')
+
+def _is_library(obj) -> bool:
+    module = getattr(obj, '__module__', None) or ''
+    # Closures built by library functions (e.g. gen_register) depend on
+    # their arguments so are digested like user code
+    return (module.split('.')[0] in _LIBRARY_MODULES
+            and '<locals>' not in getattr(obj, '__qualname__', ''))
+
+
+class _Undigestable(Exception):
+    pass
+
+
+def _source_digest(obj, h, seen):
+    '''
+    Feeds the source of obj into h along with everything it refers to:
+    closure cells and the globals named by its code, so editing an ISA
+    which a family closure only imports still changes the digest.  Only
+    things which are the same in every process are hashed, never reprs
+    holding addresses.  Raises _Undigestable for values which have no
+    such form.
+    '''
+    if isinstance(obj, family_closure):
+        obj = obj.fc
+    if id(obj) in seen:
+        return
+    if isinstance(obj, (types.FunctionType, type)):
+        seen.add(id(obj))
+        h.update(f'{obj.__module__}.{obj.__qualname__}.{obj.__name__}'.encode())
+        if _is_library(obj):
+            return
+        try:
+            h.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            # exec'd code (e.g. IR.add_peak_instruction) has no source,
+            # it is covered by the code objects and globals below
+            pass
+        if isinstance(obj, types.FunctionType):
+            # lambdas sharing a line share their source
+            _code_digest(obj.__code__, h)
+            for cell in obj.__closure__ or ():
+                try:
+                    _source_digest(cell.cell_contents, h, seen)
+                except ValueError:
+                    # empty cell
+                    pass
+            for name in sorted(_code_names(obj.__code__)):
+                if name in obj.__globals__:
+                    h.update(name.encode())
+                    _source_digest(obj.__globals__[name], h, seen)
+        else:
+            # the source of a class built in a generator does not show the
+            # generator's arguments, its fields and methods do
+            for name, value in getattr(obj, 'field_dict', {}).items():
+                h.update(str(name).encode())
+                _source_digest(value, h, seen)
+            for name, value in sorted(vars(obj).items()):
+                if isinstance(value, types.FunctionType):
+                    h.update(name.encode())
+                    _source_digest(value, h, seen)
+    elif isinstance(obj, (int, float, str, bytes, bool, type(None), Bit, BitVector)):
+        h.update(repr(obj).encode())
+    elif isinstance(obj, (tuple, list)):
+        seen.add(id(obj))
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            _source_digest(item, h, seen)
+    elif isinstance(obj, (dict, set, frozenset)):
+        seen.add(id(obj))
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        _unordered_digest(obj.items() if isinstance(obj, dict) else obj, h, seen)
+    elif isinstance(obj, types.ModuleType):
+        h.update(obj.__name__.encode())
+    elif not _is_library(type(obj)) and hasattr(obj, '__dict__'):
+        # instances of user classes, e.g. Enum members
+        seen.add(id(obj))
+        _source_digest(type(obj), h, seen)
+        for name, value in sorted(vars(obj).items()):
+            h.update(name.encode())
+            _source_digest(value, h, seen)
+    elif _is_library(type(obj)) and type(obj).__module__ != 'builtins':
+        h.update(type(obj).__qualname__.encode())
+    else:
+        raise _Undigestable(type(obj))
+
+
+def _unordered_digest(items, h, seen):
+    # iteration order depends on the hash seed so the items are fed in the
+    # order of their own digests
+    digests = []
+    for item in items:
+        sub = hashlib.sha256()
+        _source_digest(item, sub, set(seen))
+        digests.append(sub.digest())
+    for digest in sorted(digests):
+        h.update(digest)
+
+
+def _code_digest(code, h):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_digest(const, h)
+        elif isinstance(const, frozenset):
+            h.update(repr(sorted(const, key=repr)).encode())
+        else:
+            h.update(repr(const).encode())
+
+
+def _code_names(code) -> tp.Set[str]:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+_peak_digest_ = None
+
+def _peak_digest() -> str:
+    '''
+    Digest of the sources of the peak package, so any change to peak
+    invalidates the store rather than only a version bump.
+    '''
+    global _peak_digest_
+    if _peak_digest_ is None:
+        h = hashlib.sha256()
+        root = os.path.dirname(os.path.abspath(peak.__file__))
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith('.py'):
+                    path = os.path.join(dirpath, name)
+                    h.update(os.path.relpath(path, root).encode())
+                    with open(path, 'rb') as f:
+                        h.update(f.read())
+        _peak_digest_ = h.hexdigest()
+    return _peak_digest_
+
+
+_fingerprints = weakref.WeakKeyDictionary()
+
+def source_fingerprint(fc) -> tp.Optional[str]:
+    '''
+    Digest of the source of a family closure and of the user code it
+    depends on, None if it depends on a value which cannot be digested.
+    Memoized per closure, sources are not expected to change while the
+    process runs.
+    '''
+    try:
+        return _fingerprints[fc]
+    except (KeyError, TypeError):
+        pass
+    h = hashlib.sha256()
+    try:
+        _source_digest(fc, h, set())
+        digest = h.hexdigest()
+    except _Undigestable:
+        digest = None
+    try:
+        _fingerprints[fc] = digest
+    except TypeError:
+        pass
+    return digest
+
+
+def rule_key(arch_fc, ir_fc, path_constraints, solver_name: str) -> tp.Tuple[tp.Optional[str], dict]:
+    '''
+    Returns (key, info) for one mapping problem.  info is what the key is
+    derived from and is stored with the record for listing.  key is None
+    when either closure has no source fingerprint, such problems are
+    never stored.
+    '''
+    # lists not tuples so info compares equal after a json round trip
+    constraints = sorted(
+        [repr(path), [repr(c) for c in cs]]
+        for path, cs in path_constraints.items()
+    )
+    info = {
+        'format': _FORMAT_VERSION,
+        'peak': _peak_digest(),
+        'arch': source_fingerprint(arch_fc),
+        'ir': source_fingerprint(ir_fc),
+        'constraints': constraints,
+        'solver': solver_name,
+    }
+    if info['arch'] is None or info['ir'] is None:
+        return None, info
+    key = hashlib.sha256(json.dumps(info, sort_keys=True).encode()).hexdigest()
+    return key, info
+
+
+class RuleStore:
+    '''
+    Directory of solved mapping problems, one json record per key holding
+    the encoded rewrite rule or null when the solver proved there is none.
+    Records are plain json so the store can be shared between processes
+    and machines.
+    '''
+    def __init__(self, directory: str):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f'{key}.json')
+
+    def get(self, key: str) -> tp.Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, record: dict):
+        # Write then rename so concurrent workers never see partial records
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def lookup(self, ir_mapper, solver_name: str):
+        '''
+        Returns (True, rule or None) when the result of solving ir_mapper is
+        stored and (False, None) otherwise.
+        '''
+        am = ir_mapper.archmapper
+        key, info = rule_key(am.peak_fc, ir_mapper.peak_fc, am.path_constraints, solver_name)
+        if key is None:
+            return False, None
+        record = self.get(key)
+        if record is None or record.get('key') != info:
+            return False, None
+        if record['rule'] is None:
+            return True, None
+        try:
+            ibinding, obinding = decode_rule(record['rule'], rule_roots(am.peak_fc, ir_mapper.peak_fc))
+        except (KeyError, IndexError, TypeError, ValueError):
+            # written by an incompatible version, solve again
+            return False, None
+        return True, RewriteRule(ibinding, obinding, ir_mapper.peak_fc, am.peak_fc)
+
+    def record(self, ir_mapper, solver_name: str, rule: tp.Optional[RewriteRule]):
+        am = ir_mapper.archmapper
+        key, info = rule_key(am.peak_fc, ir_mapper.peak_fc, am.path_constraints, solver_name)
+        if key is None:
+            return
+        if rule is not None:
+            try:
+                rule = encode_rule(rule, rule_roots(am.peak_fc, ir_mapper.peak_fc))
+            except (TypeError, ValueError):
+                # holds a value the codec cannot represent, do not store it
+                return
+        self.put(key, {
+            'key': info,
+            'arch': _fc_name(am.peak_fc),
+            'ir': _fc_name(ir_mapper.peak_fc),
+            'created': time.time(),
+            'rule': rule,
+        })
+
+    def keys(self) -> tp.List[str]:
+        return sorted(name[:-len('.json')] for name in os.listdir(self._directory)
+                if name.endswith('.json'))
+
+    def entries(self) -> tp.Iterator[tp.Tuple[str, dict]]:
+        '''
+        (key, record) of every readable record.
+        '''
+        for key in self.keys():
+            record = self.get(key)
+            if record is not None:
+                yield key, record
+
+    def invalidate(self,
+            key: tp.Optional[str] = None,
+            arch: tp.Optional[str] = None,
+            ir: tp.Optional[str] = None) -> int:
+        '''
+        Removes the records matching every given filter, arch/ir match the
+        name of the family closure.  Without filters the store is cleared.
+        Returns the number of records removed.
+        '''
+        removed = 0
+        for k, record in list(self.entries()):
+            if ((key is None or k == key)
+                    and (arch is None or record.get('arch') == arch)
+                    and (ir is None or record.get('ir') == ir)):
+                removed += self._remove(k)
+        return removed
+
+    def vacuum(self, max_age: tp.Optional[float] = None) -> int:
+        '''
+        Removes records which can never be hit again (unreadable, from an
+        older format or other peak sources), left over temporary files and, when
+        max_age is given, records older than max_age seconds.
+        '''
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self._directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self._directory, name))
+                removed += 1
+        for key in self.keys():
+            record = self.get(key)
+            stale = (record is None
+                or record.get('key', {}).get('format') != _FORMAT_VERSION
+                or record.get('key', {}).get('peak') != _peak_digest()
+                or max_age is not None and now - record.get('created', 0) > max_age)
+            if stale:
+                removed += self._remove(key)
+        return removed
+
+    def _remove(self, key: str) -> int:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return 0
+        return 1
+
+    def __len__(self):
+        return len(self.keys())
+
+
+_rule_store = None
+
+def set_rule_store(directory: tp.Optional[str]) -> tp.Optional[RuleStore]:
+    '''
+    Directs IRMapper.solve to look up and record results under directory.
+    Passing None disables the store.  Defaults to $PEAK_RULE_STORE.
+    '''
+    global _rule_store
+    if directory is None:
+        _rule_store = None
+    else:
+        _rule_store = RuleStore(directory)
+    return _rule_store
+
+def get_rule_store() -> tp.Optional[RuleStore]:
+    return _rule_store
+
+set_rule_store(os.environ.get('PEAK_RULE_STORE'))
+
+
+def _fc_name(fc) -> str:
+    if isinstance(fc, family_closure):
+        fc = fc.fc
+    return getattr(fc, '__qualname__', repr(fc))
@@ -4,16 +4,31 @@ from hwtypes import BitVector
 
 class ROM(Peak, gen_input_t=False, gen_output_t=False):
     def __init__(self, type, n, mem, init=0):
-        self.mem = []
-        for i in range(n):
-            data = mem[i] if i < len(mem) else init
-            self.mem.append( gen_register2(BitVector.get_family(), type, init=data)() )
+        # A word is only read from mem and given a register the first time it
+        # is addressed, so mem can be a large lazy sequence such as an
+        # InstructionStream over a mapped program image.  Lists are still
+        # copied so later changes to the caller's list are not seen.
+        self._Register = gen_register2(BitVector.get_family(), type, init=init)
+        if isinstance(mem, list):
+            mem = list(mem)
+        self._data = mem
+        self._init = init
+        self.mem = [None] * n
+
+    def _register(self, addr):
+        reg = self.mem[addr]
+        if reg is None:
+            reg = self._Register()
+            if addr < len(self._data):
+                reg.value = self._data[addr]
+            self.mem[addr] = reg
+        return reg
 
     def __call__(self, addr):
-        return self.mem[int(addr)](0, 0)
+        return self._register(int(addr))(0, 0)
 
 class RAM(ROM, gen_input_t=False, gen_output_t=False):
     def __call__(self, addr, data, wen):
-        return self.mem[int(addr)](data, wen)
+        return self._register(int(addr))(data, wen)
 
 Memory = RAM
@@ -19,6 +19,7 @@ setup(
         "magma-lang",
         "coreir",
         "ast-tools",
+        "numpy",
     ],
     python_requires='>=3.7'
 )
@@ -327,3 +327,286 @@ def test_non_const_constraint():
             ("in0",): in0_constraint,  # Not Const
         }
         run_constraint_test(ir_fc, constraints=constraints, solved=solved)
+
+@family_closure
+def AddSub_fc(family):
+    Data = family.BitVector[4]
+    class Op(Enum):
+        add = 1
+        sub = 2
+    class Inst(Product):
+        op = Op
+        inv = family.Bit
+
+    @family.assemble(locals(), globals())
+    class Arch(Peak):
+        @name_outputs(out=Data)
+        def __call__(self, inst: Const(Inst), a: Data, b: Data) -> Data:
+            if inst.op == Op.add:
+                ret = a + b
+            else:
+                ret = a - b
+            if inst.inv:
+                return ~ret
+            return ret
+    return Arch
+
+def binop_fc(fn):
+    @family_closure
+    def IR_fc(family):
+        Data = family.BitVector[4]
+        @family.assemble(locals(), globals())
+        class IR(Peak):
+            @name_outputs(out=Data)
+            def __call__(self, in0: Data, in1: Data) -> Data:
+                return fn(in0, in1)
+        return IR
+    return IR_fc
+
+def test_map_ir():
+    from peak.ir import IR
+    from peak.mapper import map_ir
+
+    ir = IR()
+    ir.add_instruction('Add', binop_fc(lambda a, b: a + b))
+    ir.add_instruction('Sub', binop_fc(lambda a, b: a - b))
+    ir.add_instruction('Nor', binop_fc(lambda a, b: ~(a | b)))
+
+    for workers in (1, 2):
+        result = map_ir(AddSub_fc, ir, workers=workers)
+        assert list(result.rules) == list(result.times) == ['Add', 'Sub', 'Nor']
+        assert result.rules['Nor'] is None
+        for name in ('Add', 'Sub'):
+            rr = result.rules[name]
+            assert rr.ir_fc is ir.instructions[name]
+            assert rr.arch_fc is AddSub_fc
+            assert rr.verify() is None
+        assert all(t >= 0 for t in result.times.values())
+
+    assert map_ir(AddSub_fc, ir, workers=2, instructions=['Sub']).rules.keys() == {'Sub'}
+
+def test_solver_session():
+    arch_mapper = ArchMapper(AddSub_fc)
+    fns = [lambda a, b: a + b, lambda a, b: ~(a | b), lambda a, b: ~(a - b)]
+    ir_mappers = [arch_mapper.process_ir_instruction(binop_fc(fn)) for fn in fns]
+    expected = [m.solve(incremental=False) is not None for m in ir_mappers]
+    assert expected == [True, False, True]
+    session = arch_mapper.solver_session()
+    for _ in range(2):
+        for ir_mapper, found in zip(ir_mappers, expected):
+            rr = ir_mapper.solve()
+            assert (rr is not None) == found
+            if rr is not None:
+                assert rr.verify() is None
+    assert arch_mapper.solver_session() is session
+    arch_mapper.close()
+    assert arch_mapper.solver_session() is not session
+    arch_mapper.close()
+
+def test_map_ir_paths():
+    from peak.mapper.rule_codec import _walk_path
+    from peak.mapper.mapper import _create_path_to_adt
+    from hwtypes.modifiers import strip_modifiers
+
+    T = strip_modifiers(PE_fc(family.PyFamily()).input_t)
+    for path in _create_path_to_adt(T):
+        encoded = _walk_path(T, path, True)
+        # encoded paths only hold picklable keys
+        assert all(isinstance(k, (int, str)) for k in encoded)
+        assert _walk_path(T, encoded, False) == path
+
+def test_rule_store(tmp_path):
+    from peak.mapper import set_rule_store, RuleStore
+
+    fns = [lambda a, b: a - b, lambda a, b: ~(a | b)]
+    store = set_rule_store(str(tmp_path))
+    try:
+        arch_mapper = ArchMapper(AddSub_fc)
+        ir_mappers = [arch_mapper.process_ir_instruction(binop_fc(fn)) for fn in fns]
+        first = [m.solve() for m in ir_mappers]
+        assert first[0] is not None and first[1] is None
+        assert len(store) == 2
+
+        # Solved from the store, the solver is never opened
+        arch_mapper = ArchMapper(AddSub_fc)
+        ir_mappers = [arch_mapper.process_ir_instruction(binop_fc(fn)) for fn in fns]
+        rr, none = [m.solve() for m in ir_mappers]
+        assert not arch_mapper._sessions
+        assert none is None
+        assert rr.ibinding == first[0].ibinding
+        assert rr.obinding == first[0].obinding
+        assert rr.verify() is None
+
+        # Path constraints are part of the key
+        for inv, found in ((1, False), (0, True)):
+            for _ in range(2):
+                constrained = ArchMapper(AddSub_fc, path_constraints={('inst', 'inv'): inv})
+                rr = constrained.process_ir_instruction(binop_fc(fns[0])).solve()
+                assert (rr is not None) == found
+            assert not constrained._sessions
+        assert len(store) == 4
+
+        names = {record['ir'] for _, record in store.entries()}
+        assert names == {'binop_fc.<locals>.IR_fc'}
+        assert store.vacuum() == 0
+        key, _ = next(store.entries())
+        assert store.invalidate(key=key) == 1
+        assert store.invalidate(arch='AddSub_fc') == 3
+        assert len(store) == 0
+
+        (tmp_path / 'junk.json').write_text('{')
+        (tmp_path / 'junk.tmp').write_text('')
+        assert store.vacuum() == 2
+        assert not list(tmp_path.iterdir())
+    finally:
+        set_rule_store(None)
+
+def test_rule_key_across_processes():
+    import subprocess, sys, os
+    src = (
+        "from peak.mapper.rule_store import rule_key\n"
+        "from examples.sum_pe.sim import PE_fc\n"
+        "from examples.smallir import gen_SmallIR\n"
+        "print(rule_key(PE_fc, gen_SmallIR(8).instructions['Add'], {}, 'z3')[0])\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    keys = [
+        subprocess.run([sys.executable, '-c', src], cwd=root, env=env,
+            stdout=subprocess.PIPE, check=True).stdout
+        for _ in range(2)
+    ]
+    assert keys[0] and keys[0] == keys[1]
+
+def test_source_fingerprint_values():
+    from peak.mapper.rule_store import source_fingerprint
+
+    def gen(table):
+        @family_closure
+        def IR_fc(family):
+            Data = family.BitVector[8]
+            @family.assemble(locals(), globals())
+            class IR(Peak):
+                @name_outputs(out=Data)
+                def __call__(self, a: Data) -> Data:
+                    return a + table['k']
+            return IR
+        return IR_fc
+
+    fps = [source_fingerprint(gen(table)) for table in
+            ({'k': 1}, {'k': 2}, {'k': 1}, {'k': {1, 2}}, {'k': {2, 1, 3}}, {'k': {2, 1}})]
+    assert None not in fps
+    assert fps[0] != fps[1]
+    assert fps[0] == fps[2]
+    assert fps[3] == fps[5] != fps[4]
+    # Values with no stable form have no fingerprint and are never stored
+    assert source_fingerprint(gen({'k': object()})) is None
+
+def test_cegis():
+    @family_closure
+    def Arch3_fc(family):
+        Data = family.BitVector[4]
+        class Op(Enum):
+            add = 1
+            sub = 2
+            mul_c = 3
+        class Inst(Product):
+            op = Op
+            imm = Data
+
+        @family.assemble(locals(), globals())
+        class Arch3(Peak):
+            @name_outputs(out=Data)
+            def __call__(self, inst: Const(Inst), a: Data, b: Data, c: Data) -> Data:
+                if inst.op == Op.add:
+                    return a + b + inst.imm
+                elif inst.op == Op.sub:
+                    return a - b
+                return a * c
+        return Arch3
+
+    fns = [
+        lambda a, b: a + b,
+        lambda a, b: a - b - 3,
+        lambda a, b: a * b,
+        lambda a, b: ~(a | b),
+        lambda a, b: a + b + b,
+    ]
+    for arch_fc in (AddSub_fc, Arch3_fc):
+        arch_mapper = ArchMapper(arch_fc)
+        for fn in fns:
+            ir_mapper = arch_mapper.process_ir_instruction(binop_fc(fn))
+            expected = ir_mapper.solve()
+            rr = ir_mapper.solve(cegis=True)
+            assert (rr is None) == (expected is None)
+            if rr is not None:
+                assert rr.verify() is None
+
+def test_cegis_automapper():
+    # The quantified formula for this arch exhausts z3, see test_automapper
+    IR = gen_SmallIR(8)
+    arch_mapper = ArchMapper(PE_fc)
+    expect_found = ('Add', 'Sub', 'And', 'Nand', 'Or', 'Nor')
+    for ir_name, ir_fc in IR.instructions.items():
+        rewrite_rule = arch_mapper.process_ir_instruction(ir_fc).solve(cegis=True)
+        assert (rewrite_rule is not None) == (ir_name in expect_found)
+        if rewrite_rule is not None:
+            assert rewrite_rule.verify() is None
+
+def addsub_gen(width):
+    @family_closure
+    def AddSubW_fc(family):
+        Data = family.BitVector[width]
+        class Op(Enum):
+            add = 1
+            sub = 2
+        class Inst(Product):
+            op = Op
+            imm = Data
+
+        @family.assemble(locals(), globals())
+        class AddSubW(Peak):
+            @name_outputs(out=Data)
+            def __call__(self, inst: Const(Inst), a: Data, b: Data) -> Data:
+                if inst.op == Op.add:
+                    return a + b + inst.imm
+                return a - b - inst.imm
+        return AddSubW
+    return AddSubW_fc
+
+def binop_gen(fn):
+    def gen(width):
+        @family_closure
+        def IRW_fc(family):
+            Data = family.BitVector[width]
+            @family.assemble(locals(), globals())
+            class IRW(Peak):
+                @name_outputs(out=Data)
+                def __call__(self, in0: Data, in1: Data) -> Data:
+                    return fn(in0, in1, Data)
+            return IRW
+        return IRW_fc
+    return gen
+
+def test_map_reduced():
+    from peak.mapper import map_reduced
+
+    small = ArchMapper(addsub_gen(4)).process_ir_instruction(binop_gen(lambda a, b, T: b - a)(4))
+    candidates = small.candidates()
+    # b - a only maps with the inputs swapped
+    assert len(candidates) == 1
+    for fi, bi, bo in candidates:
+        assert [arch for ir, arch in small.input_bindings[fi][bi] if ir == ('in1',)] == [('a',)]
+
+    fns = [
+        lambda a, b, T: b - a,
+        lambda a, b, T: a - b + T(1),
+        lambda a, b, T: a | b,
+    ]
+    for fn in fns:
+        expected = ArchMapper(addsub_gen(16)).process_ir_instruction(binop_gen(fn)(16)).solve()
+        for cegis in (False, True):
+            rr = map_reduced(addsub_gen, binop_gen(fn), 16, cegis=cegis)
+            assert (rr is None) == (expected is None)
+            if rr is not None:
+                assert rr.verify() is None
@@ -7,9 +7,11 @@ from examples.pico.isa import Inst as pico_isa
 from examples.min_pe.isa import ISA_fc as gen_min_isa
 import examples.pico.asm as pico_asm
 
-from hwtypes import BitVector, Bit
+from hwtypes import BitVector, Bit, SMTBitVector
 from hwtypes import make_modifier
 from hwtypes.adt import Product, Tuple, Sum, Enum
+from hwtypes.adt_meta import ReservedNameError
+import numpy as np
 import pytest
 
 FooBV = make_modifier('Foo')(BitVector)
@@ -178,3 +180,261 @@ def test_from_subfields():
     assert not as_t[B].match
     assert as_t[T].value == at
 
+
+@pytest.mark.parametrize("bv_type", [BitVector, SMTBitVector])
+def test_from_fields_padding(bv_type):
+    class A(Product):
+        x = bv_type[2]
+        y = bv_type[3]
+
+    S = Sum[A, bv_type[1]]
+    AS = AssembledADT[S, Assembler, bv_type]
+    asm = Assembler(S)
+    assert asm.width == 6
+
+    lo, hi = asm.layout[bv_type[1]]
+    tag = int(asm.assemble_tag(bv_type[1], BitVector))
+    for default_bv in (0, 1):
+        v = AS.from_fields(bv_type[1], bv_type[1](1), default_bv=default_bv)
+        padding = ((1 << asm.width) - (1 << hi)) if default_bv else 0
+        assert int(v._value_.value.constant_value() if bv_type is SMTBitVector else v._value_) \
+                == tag | 1 << lo | padding
+
+    AA = AssembledADT[A, Assembler, bv_type]
+    a = AA.from_fields(x=bv_type[2](1), y=bv_type[3](5))
+    # SMTBit does not convert to bool on every hwtypes version
+    def true(bit):
+        return bit.value.simplify().is_true() if bv_type is SMTBitVector else bool(bit)
+    assert true(a.x == bv_type[2](1))
+    assert true(a.y == bv_type[3](5))
+
+
+def test_field_access():
+    from peak.assembler.assembled_adt import _TAG
+    class A(Product):
+        x = BitVector[2]
+        b = Bit
+
+    S = Sum[A, Bit]
+    AA = AssembledADT[A, Assembler, BitVector]
+    AS = AssembledADT[S, Assembler, BitVector]
+
+    a = AA(A(BitVector[2](2), Bit(1)))
+    assert a.x == BitVector[2](2)
+    assert isinstance(a.b, Bit) and a.b == Bit(1)
+    with pytest.raises(KeyError):
+        a[_TAG]
+    with pytest.raises(KeyError):
+        a['y']
+    with pytest.raises(AttributeError):
+        a.y
+
+    s = AS(S(Bit(1)))
+    assert s[_TAG] == Assembler(S).assemble_tag(Bit, BitVector)
+    assert s[Bit].match
+    assert s[Bit].value == Bit(1)
+    assert not s[A].match
+    with pytest.raises(KeyError):
+        s[BitVector[2]]
+
+
+def test_lazy_smt_value():
+    from peak.assembler.assembled_adt import _TAG
+    SBV = SMTBitVector
+    class A(Product):
+        x = SBV[2]
+        y = SBV[3]
+
+    S = Sum[A, SBV[1]]
+    AA = AssembledADT[A, Assembler, SBV]
+    AS = AssembledADT[S, Assembler, SBV]
+
+    x, y = SBV[2](), SBV[3]()
+    a = AA.from_fields(x=x, y=y)
+    # fields are read back without packing
+    assert a.x.value is x.value
+    assert a.y.value is y.value
+    with pytest.raises(AttributeError):
+        object.__getattribute__(a, '_value_')
+
+    tag = SBV[1]()
+    s = AS.from_fields(A, a, tag_bv=tag)
+    assert s[_TAG].value is tag.value
+    assert s[A].value._parts_ is a._parts_
+    assert AS(s)[A].value._parts_ is a._parts_
+
+    # packing gives the same bits as the eager path
+    packed = s._value_
+    assert packed.size == Assembler(S).width
+    lo, hi = Assembler(S).layout[A]
+    eager = AS(packed)
+    assert eager[_TAG].value is packed[0:lo].value
+    assert eager[A].value._value_.value is packed[lo:hi].value
+
+
+def test_decode_cache():
+    class E(Enum):
+        a = 0
+        b = 1
+
+    T = Tuple[E, BitVector[3]]
+    AT = AssembledADT[T, Assembler, BitVector]
+    assert AT.decode_cache_info() is None
+    AT.enable_decode_cache(maxsize=4)
+    try:
+        at = AT(5)
+        assert at == T(E.b, BitVector[3](2))
+        assert AT(5) is at
+        assert AT(BitVector[4](5)) == at
+        assert AT(T(E.b, BitVector[3](2))) is not at
+        info = AT.decode_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+    finally:
+        AT.disable_decode_cache()
+    assert AT(5) is not AT(5)
+    with pytest.raises(ValueError):
+        AT(16)
+
+    class P(Product):
+        decode_cache_info = BitVector[2]
+
+    with pytest.raises(ReservedNameError):
+        AssembledADT[P, Assembler, BitVector]
+
+
+def test_type_creation_caches():
+    class E0(Enum):
+        a = 0
+        b = 1
+
+    class E1(Enum):
+        c = 0
+
+    class A(Product):
+        e = E0
+        x = BitVector[2]
+
+    AE0 = AssembledADT[E0, Assembler, FooBV]
+    AE1 = AssembledADT[E1, Assembler, BarBV]
+    # same signature, same code but each type keeps its own annotations
+    assert AE0.from_fields.__code__ is AE1.from_fields.__code__
+    assert AE0.from_fields.__annotations__['return'] == AE0.__name__
+    assert AE1.from_fields.__annotations__['return'] == AE1.__name__
+    assert AE0.from_fields(E0.b) == E0.b
+
+    AA = AssembledADT[A, Assembler, FooBV]
+    assert AA.from_fields.__annotations__['x'] == BitVector[2].__name__
+    assert AA.e is AA.e is AE0
+    assert AA.x is BitVector[2]
+    assert list(AA._sub_types_) == ['e', 'x']
+    with pytest.raises(AttributeError):
+        AA.y
+
+
+@pytest.mark.parametrize("bv_type", [BitVector, SMTBitVector])
+def test_enum_opcodes(bv_type):
+    class E(Enum):
+        a = 1
+        b = 4
+        c = 6
+
+    def to_bool(bit):
+        if bv_type is SMTBitVector:
+            return bit.value.simplify().is_true()
+        return bool(bit)
+
+    AE = AssembledADT[E, Assembler, bv_type]
+    asm = Assembler(E)
+    assert set(AE._opcodes_) == set(E.enumerate())
+    for inst in E.enumerate():
+        assert isinstance(AE._opcodes_[inst], bv_type[asm.width])
+        for other in E.enumerate():
+            assert to_bool(AE(inst) == other) == (inst == other)
+            assert to_bool(AE(inst) != other) == (inst != other)
+
+    x = AE(bv_type[asm.width]())
+    if bv_type is SMTBitVector:
+        # the same constant is used by every comparison
+        eq0, eq1 = (x == E.b).value, (x == E.b).value
+        assert eq0.arg(1) is eq1.arg(1)
+    assert AssembledADT[Tuple[E, Bit], Assembler, bv_type]._opcodes_ is None
+
+
+def test_interning():
+    class E(Enum):
+        a = 0
+        b = 1
+
+    T = Tuple[E, BitVector[3]]
+    AT = AssembledADT[T, Assembler, BitVector]
+    assert not hasattr(AT(5), '__dict__')
+    assert AT(5) is not AT(5)
+    before = AT(5)
+    AT.enable_interning()
+    try:
+        at = AT(5)
+        assert AT(5) is at
+        assert at is not before and at == before
+        assert hash(at) == hash(before)
+        assert {before: 1}[at] == 1
+        assert AT(BitVector[4](5)) is at
+        assert AT(T(E.b, BitVector[3](2))) is at
+        assert AT.from_fields(E.b, BitVector[3](2)) is at
+        assert AT(at) is at
+        assert at == at
+        assert AT(4) is not at and AT(4) != at
+        with pytest.raises(ValueError):
+            AT(16)
+        with pytest.raises(TypeError):
+            AT(BitVector[5](5))
+        # values are held weakly
+        del at
+        assert len(AT._interned_) == 0
+    finally:
+        AT.disable_interning()
+    assert AT(5) is not AT(5)
+    with pytest.raises(TypeError):
+        AssembledADT[T, Assembler, SMTBitVector].enable_interning()
+
+    class P(Product):
+        enable_interning = Bit
+
+    with pytest.raises(ReservedNameError):
+        AssembledADT[P, Assembler, BitVector]
+
+
+@pytest.mark.parametrize("default_bv", [0, 1])
+def test_from_fields_many(default_bv):
+    class E(Enum):
+        a = 1
+        b = 4
+
+    class A(Product):
+        x = BitVector[3]
+        b = Bit
+        e = E
+
+    S = Sum[A, BitVector[2]]
+    AA = AssembledADT[A, Assembler, BitVector]
+    AS = AssembledADT[S, Assembler, BitVector]
+
+    xs = [BitVector[3](i) for i in range(8)]
+    bs = [Bit(i & 1) for i in range(8)]
+    es = [E.a, E.b] * 4
+    many = AA.from_fields_many(x=xs, b=bs, e=es, default_bv=default_bv)
+    assert len(many) == 8
+    for i, word in enumerate(many.words):
+        one = AA.from_fields(x=xs[i], b=bs[i], e=es[i], default_bv=default_bv)
+        assert int(word) == int(one._value_)
+
+    many = AS.from_fields_many(BitVector[2], np.arange(4), default_bv=default_bv)
+    for i, word in enumerate(many.words):
+        one = AS.from_fields(BitVector[2], BitVector[2](i), default_bv=default_bv)
+        assert int(word) == int(one._value_)
+        assert AS(int(word))[BitVector[2]].value == i
+
+    class P(Product):
+        from_fields_many = BitVector[2]
+
+    with pytest.raises(ReservedNameError):
+        AssembledADT[P, Assembler, BitVector]
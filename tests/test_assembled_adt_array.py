@@ -0,0 +1,89 @@
+from peak.assembler import Assembler, AssembledADTArray
+from examples.arm.isa import Inst as arm_isa
+from examples.pico.isa import Inst as pico_isa
+from hwtypes import BitVector, Bit
+from hwtypes.adt import Enum, Product, Sum, Tuple
+import numpy as np
+import pytest
+
+class E(Enum):
+    a = 1
+    b = 2
+
+class A(Product):
+    x = BitVector[3]
+    b = Bit
+    e = E
+
+S = Sum[A, E, BitVector[2]]
+
+class Inst(Product):
+    s = S
+    t = Tuple[E, BitVector[4]]
+
+def test_types():
+    assert AssembledADTArray[Inst] is AssembledADTArray[Inst, Assembler]
+    T = AssembledADTArray[Inst]
+    assert T.adt_t is Inst
+    assert T.assembler is Assembler(Inst)
+    assert T.sub_t('s') is AssembledADTArray[S]
+    assert AssembledADTArray[A].sub_t('x') is None
+
+@pytest.mark.parametrize("isa", [arm_isa, pico_isa, Inst])
+def test_round_trip(isa):
+    insts = list(isa.enumerate())
+    arr = AssembledADTArray[isa].from_insts(insts)
+    assert len(arr) == len(insts)
+    assert arr.to_insts() == insts
+    assert list(arr) == insts
+    assert arr[5] == insts[5]
+    assert arr[2:4].to_insts() == insts[2:4]
+    assert np.array_equal(arr.words, Assembler(isa).assemble_many(insts))
+
+def test_fields():
+    insts = list(Inst.enumerate())
+    arr = AssembledADTArray[Inst].from_insts(insts)
+    s = arr.s
+    assert isinstance(s, AssembledADTArray[S])
+    for T in S.fields:
+        mask = s.match(T)
+        expected = [type(inst.s._value_) is T for inst in insts]
+        assert mask.tolist() == expected
+        column = s[mask].field(T)
+        values = [inst.s._value_ for inst in insts if type(inst.s._value_) is T]
+        if T is BitVector[2]:
+            assert column.tolist() == [int(v) for v in values]
+        else:
+            assert column.to_insts() == values
+
+    a = s[s.match(A)].field(A)
+    assert a.b.tolist() == [int(inst.s._value_.b) for inst in insts if type(inst.s._value_) is A]
+    assert arr.t.field(1).tolist() == [int(inst.t[1]) for inst in insts]
+    with pytest.raises(AttributeError):
+        arr.u
+    with pytest.raises(KeyError):
+        arr.field('u')
+
+def test_from_fields():
+    insts = list(Inst.enumerate())
+    arr = AssembledADTArray[Inst].from_insts(insts)
+    assert AssembledADTArray[Inst].from_fields(s=arr.s, t=arr.t) == arr
+
+    es = [E.b, E.a, E.b]
+    xs = [1, 7, 0]
+    t = AssembledADTArray[Tuple[E, BitVector[4]]].from_fields(es, xs)
+    assert t.to_insts() == [Tuple[E, BitVector[4]](e, BitVector[4](x)) for e, x in zip(es, xs)]
+
+    a = AssembledADTArray[A].from_fields(x=np.array([5, 6]), b=[Bit(1), Bit(0)], e=[E.a, E.b])
+    s = AssembledADTArray[S].from_fields(A, a)
+    assert s.to_insts() == [S(A(BitVector[3](5), Bit(1), E.a)), S(A(BitVector[3](6), Bit(0), E.b))]
+    assert s.match(A).all()
+
+    with pytest.raises(ValueError):
+        AssembledADTArray[A].from_fields(x=[8], b=[0], e=[E.a])
+    with pytest.raises(ValueError):
+        AssembledADTArray[A].from_fields(x=[1, 2], b=[0], e=[E.a])
+    with pytest.raises(TypeError):
+        AssembledADTArray[A].from_fields(x=[1])
+    with pytest.raises(ValueError):
+        AssembledADTArray[A]([1 << Assembler(A).width])
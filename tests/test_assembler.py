@@ -1,4 +1,7 @@
 from peak.assembler.assembler import Assembler
+from peak.assembler.decode_table import DecodeTable, INVALID
+from peak.assembler.layout_cache import fingerprint, get_layout_cache, set_layout_cache
+from peak.assembler.encoding import optimize_encoding, set_encoding, clear_encoding, decode_cost, enum_codes
 from examples.demo_pes.pe5.isa import INST as pe5_isa
 from examples.arm.isa import Inst as arm_isa
 from examples.pico.isa import Inst as pico_isa
@@ -6,8 +9,11 @@ from examples.min_pe.isa import ISA_fc as gen_min_isa
 from hwtypes import AbstractBitVector
 from hwtypes.adt import Enum, Product, Tuple, Sum
 from hwtypes.adt import new_instruction
-from hwtypes import BitVector
+from hwtypes import BitVector, Bit, SMTBitVector
 from hwtypes import new
+import gc
+import weakref
+import numpy as np
 import pytest
 
 FooBV = new(BitVector, name='FooBV')
@@ -105,3 +111,479 @@ def test_sum_determinism():
     val = assemble()
     for _ in range(100):
         assert val == assemble()
+
+def test_nested_layout():
+    class E(Enum):
+        a = 1
+        b = 2
+
+    class A(Product):
+        x = BitVector[3]
+        e = E
+
+    class S(Sum[A, E]): pass
+
+    class Inst(Product):
+        s = S
+        t = Tuple[A, Bit]
+        e = E
+
+    assembler = Assembler(Inst)
+    for inst in Inst.enumerate():
+        opcode = assembler.assemble(inst)
+        assert assembler.disassemble(opcode) == inst
+        for name, field in Inst.field_dict.items():
+            sub_opcode = opcode[assembler.sub[name].idx]
+            assert int(sub_opcode) == int(Assembler(field).assemble(inst.value_dict[name]))
+
+@pytest.mark.parametrize("isa", [pe5_isa, arm_isa, pico_isa, min_isa])
+def test_assemble_many(isa):
+    assembler = Assembler(isa)
+    insts = list(isa.enumerate())
+    words = assembler.assemble_many(insts)
+    assert words.dtype == np.uint64
+    assert words.tolist() == [int(assembler.assemble(inst)) for inst in insts]
+    assert assembler.disassemble_many(words) == insts
+
+    # Bits above width are rejected like in disassemble
+    bad = words[:1] | np.uint64(1 << assembler.width)
+    with pytest.raises(ValueError):
+        assembler.disassemble(int(bad[0]))
+    with pytest.raises(ValueError):
+        assembler.disassemble_many(bad)
+
+def test_assemble_many_wide():
+    class E(Enum):
+        a = 1
+        b = 2
+
+    class A(Product):
+        x = BitVector[40]
+        e = E
+
+    class Inst(Product):
+        s = Sum[A, E, Bit]
+        y = BitVector[40]
+
+    assembler = Assembler(Inst)
+    assert assembler.width > 64
+    insts = [
+        Inst(Inst.s(A(BitVector[40](x), E.b)), BitVector[40](y))
+        for x, y in ((0, 1), (2**40-1, 5), (7, 2**39))
+    ] + [Inst(Inst.s(E.a), BitVector[40](3)), Inst(Inst.s(Bit(1)), BitVector[40](0))]
+    words = assembler.assemble_many(insts)
+    assert words.dtype == object
+    assert words.tolist() == [int(assembler.assemble(inst)) for inst in insts]
+    assert assembler.disassemble_many(words) == insts
+
+    # Sum of 3 fields leaves tag 3 unused
+    bad = np.array([words[-1] | 3], dtype=object)
+    with pytest.raises(KeyError):
+        assembler.disassemble_many(bad)
+    bad = np.array([words[0] | 1 << assembler.width], dtype=object)
+    with pytest.raises(ValueError):
+        assembler.disassemble(bad[0])
+    with pytest.raises(ValueError):
+        assembler.disassemble_many(bad)
+
+@pytest.mark.parametrize("isa", [pe5_isa, arm_isa, pico_isa])
+def test_disassemble_int(isa):
+    assembler = Assembler(isa)
+    nbytes = (assembler.width + 7) // 8
+    for inst in isa.enumerate():
+        opcode = int(assembler.assemble(inst))
+        assert assembler.disassemble(opcode) == inst
+        assert assembler.disassemble(opcode.to_bytes(nbytes, 'little')) == inst
+
+    with pytest.raises(ValueError):
+        assembler.disassemble(1 << assembler.width)
+    with pytest.raises(ValueError):
+        assembler.disassemble(-1)
+
+def test_decode_cache():
+    class E(Enum):
+        a = 0
+        b = 1
+        c = 2
+
+    assembler = Assembler(Tuple[E, BitVector[2]])
+    assert assembler.decode_cache_info() is None
+    assembler.enable_decode_cache(maxsize=2)
+    try:
+        inst0 = assembler.disassemble(0)
+        assert assembler.disassemble(0) is inst0
+        inst1 = assembler.disassemble(1)
+        assembler.disassemble(2)
+        info = assembler.decode_cache_info()
+        assert (info.hits, info.misses, info.evictions) == (1, 3, 1)
+        assert (info.maxsize, info.currsize) == (2, 2)
+        # 0 was evicted
+        assert assembler.disassemble(0) is not inst0
+        assert assembler.disassemble(0) == inst0
+        assert assembler.disassemble(BitVector[4](1)) == inst1
+    finally:
+        assembler.disable_decode_cache()
+    assert assembler.decode_cache_info() is None
+
+def test_decode_table(tmp_path):
+    class E(Enum):
+        a = 1
+        b = 2
+
+    class A(Product):
+        x = BitVector[2]
+        e = E
+
+    class Inst(Product):
+        s = Sum[A, E, Bit]
+        e = E
+
+    assembler = Assembler(Inst)
+    path = str(tmp_path / 'inst.npy')
+    expected = {}
+    for op in range(1 << assembler.width):
+        try:
+            expected[op] = assembler.disassemble(op)
+        except KeyError:
+            pass
+
+    table = assembler.enable_decode_table(path)
+    try:
+        assert len(table) == 1 << assembler.width
+        for op in range(1 << assembler.width):
+            if op in expected:
+                assert table.is_valid(op)
+                assert assembler.disassemble(op) == expected[op]
+            else:
+                assert not table.is_valid(op)
+                assert table[op] is INVALID
+                with pytest.raises(KeyError):
+                    assembler.disassemble(op)
+    finally:
+        assembler.disable_decode_table()
+
+    loaded = DecodeTable.load(assembler, path)
+    assert isinstance(loaded._table, np.memmap)
+    for op in range(1 << assembler.width):
+        assert loaded[op] == expected.get(op, INVALID)
+
+    with pytest.raises(ValueError):
+        DecodeTable.build(Assembler(arm_isa))
+    with pytest.raises(ValueError):
+        DecodeTable.load(Assembler(pico_isa), path)
+
+    # Same width, different codes
+    class E2(Enum):
+        a = 2
+        b = 1
+
+    class Inst2(Product):
+        s = Sum[A, E, Bit]
+        e = E2
+
+    assert Assembler(Inst2).width == assembler.width
+    with pytest.raises(ValueError):
+        DecodeTable.load(Assembler(Inst2), path)
+
+def test_layout_cache(tmp_path):
+    def gen_isa(family):
+        class OP(Enum):
+            Add = new_instruction()
+            Sub = new_instruction()
+            Or = 5
+
+        class A(Product):
+            op = OP
+            x = family.BitVector[3]
+            b = family.Bit
+
+        class Inst(Sum[A, OP]): pass
+        return Inst
+
+    py_isa = gen_isa(BitVector.get_family())
+    smt_isa = gen_isa(SMTBitVector.get_family())
+    assert fingerprint(py_isa) == fingerprint(smt_isa)
+    assert fingerprint(py_isa) != fingerprint(pico_isa)
+
+    expected = Assembler(py_isa)
+    old_cache = get_layout_cache()
+    cache = set_layout_cache(str(tmp_path))
+    try:
+        isa = gen_isa(BitVector.get_family())
+        assembler = Assembler(isa)
+        for inst in isa.enumerate():
+            assembler.assemble(inst)
+        assert len(list(tmp_path.glob('*.json'))) == 3
+        # A fresh cache on the same directory serves records from disk
+        cache = set_layout_cache(str(tmp_path))
+        isa = gen_isa(BitVector.get_family())
+        assembler = Assembler(isa)
+        # the fields are only needed once code is generated
+        assert len(cache) == 1
+        assert assembler.width == expected.width
+        assembler.assemble(next(iter(isa.enumerate())))
+        assert len(cache) == 3
+        assert assembler.width == expected.width
+        assert assembler.tag_width == expected.tag_width
+        # Sum.enumerate order is not stable across types so match on repr
+        expected_opcodes = {repr(inst): expected.assemble(inst) for inst in py_isa.enumerate()}
+        for inst in isa.enumerate():
+            opcode = assembler.assemble(inst)
+            assert opcode == expected_opcodes[repr(inst)]
+            assert assembler.disassemble(opcode) == inst
+    finally:
+        cache.clear()
+        set_layout_cache(old_cache.directory if old_cache is not None else None)
+
+def test_layout_record_aliases(tmp_path):
+    class FreshAssembler(Assembler, cache=False):
+        pass
+
+    def gen_isa():
+        class Cond(Enum):
+            Z = 0
+            C = 2
+            UGE = 2
+
+        class Inst(Product):
+            cond = Cond
+            x = BitVector[2]
+        return Inst
+
+    # The second isa is built from the record of the first
+    expected_isa = gen_isa()
+    expected = FreshAssembler(expected_isa)
+    expected_opcodes = {repr(inst): expected.assemble(inst) for inst in expected_isa.enumerate()}
+    isa = gen_isa()
+    assembler = FreshAssembler(isa)
+    for inst in isa.enumerate():
+        opcode = assembler.assemble(inst)
+        assert opcode == expected_opcodes[repr(inst)]
+        assert assembler.disassemble(opcode) == inst
+
+    old_cache = get_layout_cache()
+    cache = set_layout_cache(str(tmp_path))
+    try:
+        FreshAssembler(arm_isa)
+        # as is a process reading the cache
+        cache = set_layout_cache(str(tmp_path))
+        assembler = FreshAssembler(arm_isa)
+        expected = Assembler(arm_isa)
+        assert assembler.layout == expected.layout
+        assert assembler._layout_record() == expected._layout_record()
+    finally:
+        cache.clear()
+        set_layout_cache(old_cache.directory if old_cache is not None else None)
+
+def test_shared_structure(tmp_path):
+    _, _, smt_min_isa = gen_min_isa(SMTBitVector.get_family())
+    assert smt_min_isa is not min_isa
+    py_assembler = Assembler(min_isa)
+    smt_assembler = Assembler(smt_min_isa)
+    assert py_assembler is not smt_assembler
+    assert py_assembler._structure is smt_assembler._structure
+    # Generated code is compiled once and bound to each isa
+    assert py_assembler._asm.__code__ is smt_assembler._asm.__code__
+    assert py_assembler._dsm.__code__ is smt_assembler._dsm.__code__
+    assert py_assembler.width == smt_assembler.width
+    assert py_assembler.layout == smt_assembler.layout
+
+    for inst in min_isa.enumerate():
+        opcode = py_assembler.assemble(inst)
+        assert py_assembler.disassemble(opcode) == inst
+        assert isinstance(smt_assembler.disassemble(opcode), smt_min_isa)
+
+    class E(Enum):
+        a = 1
+        b = new_instruction()
+
+    def gen_isa():
+        class Inst(Product):
+            e = E
+            x = BitVector[2]
+        return Inst
+
+    a0 = Assembler(gen_isa())
+    a1 = Assembler(gen_isa())
+    path = str(tmp_path / 'table.npy')
+    try:
+        t0 = a0.enable_decode_table()
+        t1 = a1.enable_decode_table(path)
+        assert t0.table is t1.table
+        assert t1.assembler is a1
+        # A shared table is still saved
+        assert DecodeTable.load(a1, path).table.tolist() == t0.table.tolist()
+    finally:
+        a0.disable_decode_table()
+        a1.disable_decode_table()
+
+    # A stale file is replaced
+    stale = Assembler(min_isa)
+    stale.enable_decode_table(path)
+    stale.disable_decode_table()
+    try:
+        t1 = a1.enable_decode_table(path)
+        assert DecodeTable.load(a1, path).table.tolist() == t1.table.tolist()
+    finally:
+        a1.disable_decode_table()
+
+def test_optimize_encoding():
+    class OP(Enum):
+        a = new_instruction()
+        b = new_instruction()
+        c = 6
+
+    class A(Product):
+        op = OP
+        x = BitVector[3]
+
+    class B(Product):
+        y = BitVector[2]
+
+    class Inst(Sum[A, OP, B]): pass
+
+    encoding = optimize_encoding(Inst)
+    assert set(encoding) == {fingerprint(Inst), fingerprint(OP)}
+    codes = encoding[fingerprint(OP)]['codes']
+    assert codes['c'] == 6
+    assert decode_cost(list(codes.values()), 3) < decode_cost([0, 1, 6], 3)
+
+    set_encoding(encoding)
+    try:
+        assembler = Assembler(Inst)
+        op_assembler = Assembler(OP)
+        assert op_assembler.width == 3
+        for inst in OP.enumerate():
+            assert op_assembler.assemble(inst) == codes[inst._name_]
+        for inst in Inst.enumerate():
+            assert assembler.disassemble(assembler.assemble(inst)) == inst
+    finally:
+        clear_encoding()
+
+    calls = []
+    def counting_cost(codes, width):
+        calls.append(codes)
+        return decode_cost(codes, width)
+
+    optimize_encoding(OP, counting_cost, max_trials=3)
+    # the default encoding and then max_trials moves
+    assert len(calls) == 4
+
+def test_encoding_not_cached(tmp_path):
+    class FreshAssembler(Assembler, cache=False):
+        pass
+
+    class OP(Enum):
+        a = new_instruction()
+        b = new_instruction()
+        c = new_instruction()
+        d = new_instruction()
+        e = new_instruction()
+
+    default = {inst._name_: code for inst, code in enum_codes(OP)[0].items()}
+    encoding = optimize_encoding(OP, lambda codes, width: -sum(codes))
+    optimized = encoding[fingerprint(OP)]['codes']
+    assert optimized != default
+
+    def codes(assembler):
+        return {inst._name_: int(assembler.assemble(inst)) for inst in OP.enumerate()}
+
+    old_cache = get_layout_cache()
+    set_layout_cache(str(tmp_path))
+    try:
+        set_encoding(encoding)
+        try:
+            asm = FreshAssembler(OP)
+            assert codes(asm) == optimized
+        finally:
+            clear_encoding()
+        assert not list(tmp_path.glob('*.json'))
+        # asm still holds the optimized structure
+        assert codes(FreshAssembler(OP)) == default
+        # as does a process reading the cache
+        set_layout_cache(str(tmp_path))
+        assert codes(FreshAssembler(OP)) == default
+        assert codes(asm) == optimized
+    finally:
+        set_layout_cache(old_cache.directory if old_cache is not None else None)
+
+def test_instance_cache():
+    class SmallAssembler(Assembler, cache_size=2):
+        pass
+
+    class OP(Enum):
+        a = 0
+        b = 1
+
+    # hwtypes may intern structurally equal types, so every isa gets its
+    # own field width
+    widths = iter(range(2, 8))
+    def gen_isa():
+        class I(Product):
+            op = OP
+            x = BitVector[next(widths)]
+        return I
+
+    isa0 = gen_isa()
+    asm0 = SmallAssembler(isa0)
+    assert SmallAssembler(isa0) is asm0
+    info = SmallAssembler.cache_info()
+    assert (info.hits, info.misses, info.maxsize, info.currsize) == (1, 1, 2, 1)
+
+    isa1 = gen_isa()
+    isa_ref = weakref.ref(isa1)
+    SmallAssembler(isa1)
+    del isa1
+    for _ in range(2):
+        SmallAssembler(gen_isa())
+    gc.collect()
+    info = SmallAssembler.cache_info()
+    assert info.evictions == 2
+    # isa0 was evicted but is still alive so the same assembler is returned
+    assert SmallAssembler(isa0) is asm0
+    # isa1 was evicted and nothing else referenced it
+    assert isa_ref() is None
+
+    SmallAssembler.cache_clear()
+    info = SmallAssembler.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 0, 0)
+    assert SmallAssembler(isa0) is not asm0
+
+
+def test_valid_mask():
+    class E(Enum):
+        a = 1
+        b = 2
+
+    class A(Product):
+        x = BitVector[2]
+        e = E
+
+    class Inst(Product):
+        s = Sum[A, E, Bit]
+        e = E
+
+    assembler = Assembler(Inst)
+    words = list(range(1 << assembler.width)) + [1 << assembler.width]
+    valid, strict = [], []
+    for op in words:
+        try:
+            inst = assembler.disassemble(op)
+        except (KeyError, ValueError):
+            valid.append(False)
+            strict.append(False)
+        else:
+            valid.append(True)
+            strict.append(int(assembler.assemble(inst)) == op)
+    assert any(valid) and not all(valid) and strict != valid
+
+    assert assembler.valid_mask(words).tolist() == valid
+    assert assembler.valid_mask(words, strict=True).tolist() == strict
+    assert [assembler.is_valid(op) for op in words] == valid
+    assert [assembler.is_valid(op, strict=True) for op in words] == strict
+    assembler.enable_decode_table()
+    try:
+        assert [assembler.is_valid(op) for op in words] == valid
+        assert [assembler.is_valid(op, strict=True) for op in words] == strict
+    finally:
+        assembler.disable_decode_table()
@@ -0,0 +1,100 @@
+import mmap
+import tempfile
+
+from peak import ROM
+from peak.assembler import Assembler, AssembledADTArray, InstructionStream
+from examples.arm.isa import Inst as arm_isa
+from examples.pico.isa import Inst as pico_isa
+import numpy as np
+import pytest
+
+def _pack(asm, insts, word_bytes=None, byteorder='little'):
+    if word_bytes is None:
+        word_bytes = (asm.width + 7) // 8
+    return b''.join(int(asm.assemble(inst)).to_bytes(word_bytes, byteorder)
+            for inst in insts)
+
+@pytest.mark.parametrize("isa", [arm_isa, pico_isa])
+@pytest.mark.parametrize("byteorder", ['little', 'big'])
+@pytest.mark.parametrize("align", [0, 3])
+def test_stream(isa, byteorder, align):
+    asm = Assembler(isa)
+    insts = list(isa.enumerate())[:200]
+    word_bytes = (asm.width + 7) // 8 + align
+    data = b'hdr' + _pack(asm, insts, word_bytes, byteorder) + b'x'
+
+    stream = InstructionStream(isa, data, word_bytes=word_bytes,
+            byteorder=byteorder, offset=3)
+    assert len(stream) == len(insts)
+    assert stream[7] == insts[7]
+    assert stream[-1] == insts[-1]
+    assert list(stream) == insts
+    assert list(stream[10:50:3]) == insts[10:50:3]
+    assert list(stream[::-1][:5]) == insts[::-1][:5]
+    assert stream.words().tolist() == [int(asm.assemble(i)) for i in insts]
+    assert stream[2:9].words().tolist() == stream.words()[2:9].tolist()
+    arr = AssembledADTArray[isa](stream.words())
+    assert arr.to_insts() == insts
+    with pytest.raises(IndexError):
+        stream[len(insts)]
+
+def test_stream_buffers():
+    asm = Assembler(pico_isa)
+    insts = list(pico_isa.enumerate())[:64]
+    data = bytearray(_pack(asm, insts))
+    stream = InstructionStream(asm, data)
+    assert list(stream) == insts
+    # the buffer is viewed, not copied
+    data[0:3] = data[3:6]
+    assert stream[0] == insts[1]
+
+    with tempfile.TemporaryFile() as f:
+        f.write(bytes(data))
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            stream = InstructionStream(asm, m)
+            assert stream[5] == insts[5]
+            del stream
+
+    with pytest.raises(ValueError):
+        InstructionStream(asm, data, word_bytes=2)
+    with pytest.raises(ValueError):
+        InstructionStream(asm, data, byteorder='middle')
+
+def test_stream_cache():
+    asm = Assembler(pico_isa)
+    inst = next(iter(pico_isa.enumerate()))
+    stream = InstructionStream(asm, _pack(asm, [inst] * 8), cache=4)
+    assert stream.cache_info().currsize == 0
+    assert stream[0] is stream[5]
+    info = stream.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+    assert InstructionStream(asm, b'').cache_info() is None
+
+def test_rom_is_lazy():
+    class Image:
+        def __init__(self, stream):
+            self.stream = stream
+            self.reads = []
+        def __len__(self):
+            return len(self.stream)
+        def __getitem__(self, idx):
+            self.reads.append(idx)
+            return self.stream[idx]
+
+    asm = Assembler(pico_isa)
+    insts = list(pico_isa.enumerate())[:32]
+    image = Image(InstructionStream(asm, _pack(asm, insts)))
+    rom = ROM(pico_isa, 256, image, insts[0])
+    assert image.reads == []
+    assert rom(3) == insts[3]
+    assert rom(3) == insts[3]
+    assert rom(100) == insts[0]
+    assert image.reads == [3]
+
+def test_rom_copies_lists():
+    insts = list(pico_isa.enumerate())[:4]
+    mem = list(insts)
+    rom = ROM(pico_isa, 4, mem, insts[0])
+    mem[1] = insts[2]
+    assert rom(1) == insts[1]
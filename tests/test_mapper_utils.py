@@ -59,3 +59,20 @@ def test_SMTForms():
                 assert match_path in varmap
                 assert field in varmap[match_path]
 
+def test_SMTForms_dont_care():
+    class A(Product):
+        a=SBV[8]
+        b=SBit
+    S = Sum[A, SBV[8], SBit]
+    T = Tuple[S, A, SBit]
+
+    AT = AssembledADT[T, Assembler, SBV]
+    forms, varmap = SMTForms()(AT)
+    assert len(forms) == 3
+    for form in forms:
+        # Sum padding is constant so only the tag and leaves are variables
+        free = form.value._value_.value.get_free_variables()
+        leaves = set()
+        for path, var in form.varmap.items():
+            leaves |= var.value.get_free_variables()
+        assert free <= leaves | varmap[(0, _TAG)].value.get_free_variables()